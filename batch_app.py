@@ -0,0 +1,162 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from PIL import Image
+
+#own scripts
+import db_helper as db
+import text_recognition as tr
+import metrics
+
+#headless batch mode: OCR whole folders of receipts and save the results into the database
+#usage: python batch_app.py <folder or image files...> [--workers N] [--progress file] [--report file]
+
+image_extensions = (".jpg", ".jpeg", ".png")
+progress_path = "batch_progress.jsonl" #resumable progress, one line per finished file
+report_path = "batch_errors.jsonl" #per-file error report for the current run
+batch_size = 50 #how many results to collect before writing them to the database
+
+#collect every image file from the given folders and files, sorted so runs are repeatable
+def collect_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in names:
+                    if name.lower().endswith(image_extensions):
+                        files.append(os.path.abspath(os.path.join(root, name)))
+                    #
+                #
+            #
+        elif os.path.isfile(path):
+            files.append(os.path.abspath(path))
+        #
+    #
+    return sorted(set(files))
+#
+#read the progress file and return the files that have already been handled
+#files that failed with an error are only skipped if retry_errors is False
+def load_progress(path, retry_errors=False):
+    done = set()
+    if not os.path.isfile(path):
+        return done
+    #
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue #partially written line from an interrupted run
+            #
+            if entry["status"] != "error" or not retry_errors:
+                done.add(entry["file"])
+            #
+        #
+    #
+    return done
+#
+#limit tesseract to one thread per worker process, otherwise the workers fight over the cores
+#optionally log per-stage timings of every image into a json-lines file
+def init_worker(ocr_mode, metrics_path=None):
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    tr.ocr_mode = ocr_mode
+    tr.region_workers = 1 #the pool already keeps every core busy
+    if metrics_path:
+        metrics.add_sink(metrics.Jsonl_sink(metrics_path))
+    #
+#
+#worker function, runs in a separate process: load image -> preprocess + ocr + parse
+def process_file(path):
+    start = time.perf_counter()
+    info = {}
+    try:
+        with Image.open(path) as img:
+            result = tr.detect_text_from_img(img, info=info)
+        #
+        return path, result, info, None, time.perf_counter() - start
+    except Exception as e:
+        return path, None, info, f"{type(e).__name__}: {e}", time.perf_counter() - start
+    #
+#
+#write collected results to the database, then mark them as done in the progress file
+#progress is only written after the database commit, so an interrupted run never loses rows
+def flush(pending, progress_file, report_file, stats):
+    rejected = dict(db.add_rows(result for _, result, _ in pending))
+    for index, (path, result, info) in enumerate(pending):
+        if index in rejected:
+            entry = {"file": path, "status": "invalid", "reason": rejected[index], "result": result, "info": info}
+            report_file.write(json.dumps(entry) + "\n")
+            stats["invalid"] += 1
+        else:
+            entry = {"file": path, "status": "ok", "result": result, "info": info}
+            stats["ok"] += 1
+        #
+        progress_file.write(json.dumps(entry) + "\n")
+    #
+    progress_file.flush()
+    report_file.flush()
+    pending.clear()
+#
+#run the whole batch, returns a dict with counts of ok/invalid/error/skipped files
+def run_batch(paths, workers=None, progress=progress_path, report=report_path, retry_errors=False, ocr_mode="full", metrics_path=None):
+    files = collect_files(paths)
+    done = load_progress(progress, retry_errors)
+    todo = [f for f in files if f not in done]
+
+    stats = {"ok": 0, "invalid": 0, "error": 0, "skipped": len(files) - len(todo)}
+    if not todo:
+        return stats
+    #
+    workers = workers or os.cpu_count() or 1
+    pending = []
+    start = time.perf_counter()
+
+    with open(progress, "a", encoding="utf-8") as progress_file, \
+        open(report, "w", encoding="utf-8") as report_file, \
+        multiprocessing.Pool(workers, initializer=init_worker, initargs=(ocr_mode, metrics_path)) as pool:
+        #unordered so one slow receipt doesn't hold back the rest
+        for index, (path, result, info, error, elapsed) in enumerate(pool.imap_unordered(process_file, todo)):
+            if error:
+                entry = {"file": path, "status": "error", "error": error}
+                progress_file.write(json.dumps(entry) + "\n")
+                report_file.write(json.dumps(entry) + "\n")
+                stats["error"] += 1
+            else:
+                pending.append((path, result, info))
+                if len(pending) >= batch_size:
+                    flush(pending, progress_file, report_file, stats)
+                #
+            #
+            print(f"[{index + 1}/{len(todo)}] {os.path.basename(path)} ({elapsed:.2f}s)", file=sys.stderr)
+        #
+        if pending:
+            flush(pending, progress_file, report_file, stats)
+        #
+    #
+    elapsed = time.perf_counter() - start
+    print(f"{len(todo)} images in {elapsed:.1f}s ({len(todo) / elapsed:.2f} images/s, {workers} workers)", file=sys.stderr)
+    return stats
+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OCR receipt images in bulk and save the results into the database")
+    parser.add_argument("paths", nargs="+", help="image files and/or folders to scan")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="worker processes (default: number of cores)")
+    parser.add_argument("--progress", default=progress_path, help="progress file used to resume interrupted runs")
+    parser.add_argument("--report", default=report_path, help="per-file error report")
+    parser.add_argument("--retry-errors", action="store_true", help="process files that failed in a previous run again")
+    parser.add_argument("--metrics", metavar="FILE", help="append per-stage timings of every image to this json-lines file")
+    parser.add_argument("--mode", choices=("full", "regions", "tiered"), default="full", help="OCR the whole receipt, only the lines with the needed fields, or cheapest good enough tier")
+    args = parser.parse_args(argv)
+
+    stats = run_batch(args.paths, args.workers, args.progress, args.report, args.retry_errors, args.mode, args.metrics)
+    print(f"ok: {stats['ok']}, invalid: {stats['invalid']}, errors: {stats['error']}, skipped: {stats['skipped']}")
+
+    return 1 if stats["error"] else 0
+#
+if __name__ == "__main__":
+    sys.exit(main())
+#
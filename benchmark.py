@@ -0,0 +1,166 @@
+import argparse
+import itertools
+import json
+import random
+import time
+
+import numpy as np
+
+#own scripts
+import text_recognition as tr
+import synthetic_receipt as sr
+import metrics
+
+#end-to-end benchmark: render synthetic receipts with known contents, run them through detect_text_from_img
+#and report per-stage latency percentiles, images per second and how many fields were read correctly
+#everything runs offline, only tesseract itself is needed (or nothing with --preprocess-only)
+#usage: python benchmark.py [--count N] [--mode tiered] [--save baseline.json] [--compare baseline.json]
+
+percentiles = (50, 90, 99)
+fields = ("date_time", "price", "vat", "vats")
+
+#every combination of the given settings, count receipts each
+def make_cases(args):
+    return [
+        {"width": width, "skew": skew, "rotation": rotation, "noise": noise, "background": background}
+        for width, skew, rotation, noise, background
+        in itertools.product(args.widths, args.skews, args.rotations, args.noise, args.background)
+        for _ in range(args.count)
+    ]
+#
+#latency percentiles in milliseconds
+def summarize(seconds):
+    values = np.array(seconds) * 1000
+    summary = {f"p{p}": float(np.percentile(values, p)) for p in percentiles}
+    summary["count"] = len(values)
+    return summary
+#
+#compare one result field with the truth, vats are compared as (rate, amount) pairs
+def field_correct(result, truth, field):
+    if field == "vats":
+        found = [(round(v["rate"], 2), None if v["amount"] is None else round(v["amount"], 2)) for v in result.get("vats", [])]
+        return found == [(round(v["rate"], 2), round(v["amount"], 2)) for v in truth["vats"]]
+    #
+    return result.get(field) == truth[field]
+#
+def run_benchmark(args):
+    rng = random.Random(args.seed)
+    records = []
+    sink = records.append
+    tr.ocr_mode = args.mode
+
+    #render everything first, so drawing the receipts isn't part of the timing
+    images = [sr.render(rng, **case) for case in make_cases(args)]
+
+    correct = {field: 0 for field in fields}
+    correct["all"] = 0
+    totals = []
+    metrics.add_sink(sink)
+    try:
+        start = time.perf_counter()
+        for img, truth in images:
+            image_start = time.perf_counter()
+            if args.preprocess_only:
+                metrics.new_run()
+                tr.preprocess(img)
+            else:
+                result = tr.detect_text_from_img(img, use_cache=False)
+                matches = [field_correct(result, truth, field) for field in fields]
+                for field, match in zip(fields, matches):
+                    correct[field] += match
+                #
+                correct["all"] += all(matches)
+            #
+            totals.append(time.perf_counter() - image_start)
+        #
+        elapsed = time.perf_counter() - start
+    finally:
+        metrics.remove_sink(sink)
+    #
+    stages = {}
+    for record in records:
+        stages.setdefault(record["stage"], []).append(record["seconds"])
+    #
+    report = {
+        "settings": {key: getattr(args, key) for key in ("count", "seed", "widths", "skews", "rotations", "noise", "background", "mode", "preprocess_only")},
+        "images": len(images),
+        "images_per_second": len(images) / elapsed,
+        "total": summarize(totals),
+        "stages": {name: summarize(seconds) for name, seconds in stages.items()},
+    }
+    if not args.preprocess_only:
+        report["accuracy"] = {field: count / len(images) for field, count in correct.items()}
+    #
+    return report
+#
+def print_report(report):
+    print(f"{report['images']} images, {report['images_per_second']:.2f} images/s")
+    print(f"{'stage':>14} {'count':>6} " + " ".join(f"{'p' + str(p) + ' ms':>10}" for p in percentiles))
+    for name, summary in list(report["stages"].items()) + [("total", report["total"])]:
+        print(f"{name:>14} {summary['count']:>6} " + " ".join(f"{summary['p' + str(p)]:>10.1f}" for p in percentiles))
+    #
+    for field, share in report.get("accuracy", {}).items():
+        print(f"{field:>14} {share*100:6.1f} % correct")
+    #
+#
+#print the change from a saved baseline, returns False if anything got worse than the tolerance allows
+def compare_report(report, baseline, tolerance):
+    if report["settings"] != baseline.get("settings"):
+        print("warning: the baseline was made with different settings")
+    #
+    ok = True
+    print(f"{'':>14} {'baseline':>10} {'now':>10} {'change':>8}")
+    rows = [("images/s", baseline["images_per_second"], report["images_per_second"], False)]
+    for name, summary in list(report["stages"].items()) + [("total", report["total"])]:
+        old = baseline["total"] if name == "total" else baseline["stages"].get(name)
+        if old:
+            rows.append((f"{name} p50", old["p50"], summary["p50"], True))
+        #
+    #
+    for field, share in report.get("accuracy", {}).items():
+        if field in baseline.get("accuracy", {}):
+            rows.append((field, baseline["accuracy"][field], share, False))
+        #
+    #
+    for name, old, new, lower_is_better in rows:
+        change = (new - old) / old if old else 0.0
+        worse = change > tolerance if lower_is_better else change < -tolerance
+        ok = ok and not worse
+        print(f"{name:>14} {old:>10.2f} {new:>10.2f} {change*100:>7.1f}%" + ("  <- worse" if worse else ""))
+    #
+    return ok
+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark receipt text detection on synthetic receipts")
+    parser.add_argument("--count", type=int, default=2, help="receipts per combination of settings")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--widths", type=int, nargs="+", default=[600, 1000])
+    parser.add_argument("--skews", type=float, nargs="+", default=[0.0, 4.0])
+    parser.add_argument("--rotations", type=int, nargs="+", default=[0, 90])
+    parser.add_argument("--noise", type=float, nargs="+", default=[0.0, 0.05])
+    parser.add_argument("--background", type=int, nargs="+", choices=[0, 1], default=[0, 1], help="1 = receipt on a darker table")
+    parser.add_argument("--mode", choices=["full", "regions", "tiered"], default=tr.ocr_mode)
+    parser.add_argument("--preprocess-only", action="store_true", help="only time preprocessing, works without tesseract")
+    parser.add_argument("--save", metavar="FILE", help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown or accuracy drop when comparing, 0.25 = 25%%")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args)
+    print_report(report)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+        #
+    #
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        #
+        return 0 if compare_report(report, baseline, args.tolerance) else 1
+    #
+    return 0
+#
+if __name__ == "__main__":
+    raise SystemExit(main())
+#
@@ -0,0 +1,116 @@
+import argparse
+import random
+import time
+
+import numpy as np
+import cv2
+
+#own scripts
+import text_recognition as tr
+import ocr_engine
+import synthetic_receipt
+
+#compare the projection profile skew/orientation estimation against the old path
+#(cv2.minAreaRect over every foreground pixel + tesseract orientation detection) for speed and angle accuracy
+#--receipts uses all caps synthetic receipts instead of mixed case text, ascenders don't tell up from down there
+#usage: python benchmark_deskew.py [--images N] [--osd] [--receipts]
+
+words = ["SUMMA", "YHTEENSÄ", "ALV", "Maito", "leipä", "juusto", "kahvi", "banaani", "jogurtti",
+    "Kiitos", "käynnistä", "tervetuloa", "Kuitti", "kortti", "total", "amount", "grocery", "bread"]
+
+#draw lines of random text and prices, black on white like a photographed receipt
+def synthetic_text(rng, width=1200, height=1600):
+    img = np.full((height, width), 255, np.uint8)
+    y = 80
+    while y < height - 60:
+        line = " ".join(rng.choice(words) for _ in range(rng.randint(2, 4)))
+        line += f"  {rng.randint(0, 99)},{rng.randint(0, 99):02d}"
+        cv2.putText(img, line, (60, y), cv2.FONT_HERSHEY_SIMPLEX, 1.4, 0, 3, cv2.LINE_AA)
+        y += rng.randint(60, 80)
+    #
+    return img
+#
+#rotate a grayscale image counter-clockwise by angle, keeping the whole image and filling with white
+def rotate_white(img, angle):
+    img_h, img_w = img.shape
+    matrix = cv2.getRotationMatrix2D((img_w/2, img_h/2), angle, 1.0)
+    cos, sin = abs(matrix[0][0]), abs(matrix[0][1])
+    new_w, new_h = int(img_h*sin + img_w*cos), int(img_h*cos + img_w*sin)
+    matrix[0][2] += new_w/2 - img_w/2
+    matrix[1][2] += new_h/2 - img_h/2
+    return cv2.warpAffine(img, matrix, (new_w, new_h), borderValue=255)
+#
+#threshold like text_recognition.preprocess does
+def threshold(gray_img):
+    return cv2.threshold(gray_img, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+#
+#old estimation path, returns the counter-clockwise correction angle
+def old_estimate(threshold_img, use_osd):
+    coordinates = np.column_stack(np.where(threshold_img > 0))
+    angle = cv2.minAreaRect(coordinates)[-1]
+    if angle < -45:
+        angle = -(90 + angle)
+    else:
+        angle = -angle
+    #
+    if use_osd:
+        straight_img = tr.rotate_img(threshold_img, angle)
+        try:
+            #osd "Rotate" is clockwise
+            angle -= ocr_engine.get_engine().detect_rotation(tr.Image.fromarray(straight_img))
+        except Exception:
+            pass
+        #
+    #
+    return angle
+#
+#new estimation path, also counts how often the up/down orientation was decided (tesseract osd is skipped then)
+def new_estimate(threshold_img, decided):
+    angle, upright_known = tr.estimate_rotation(threshold_img)
+    decided.append(upright_known)
+    return angle
+#
+#difference between the applied rotation and the correction, wrapped to -180..180
+def angle_error(true_angle, correction):
+    return abs((true_angle + correction + 180) % 360 - 180)
+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark skew and orientation estimation")
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--osd", action="store_true", help="include tesseract orientation detection in the old path")
+    parser.add_argument("--receipts", action="store_true", help="all caps synthetic receipts instead of mixed case text")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    results = {"old": ([], []), "new": ([], [])}
+    decided = []
+    for _ in range(args.images):
+        #fine skew plus a random quarter turn
+        true_angle = rng.uniform(-10, 10) + rng.choice([0, 90, 180, 270])
+        true_angle = (true_angle + 180) % 360 - 180
+        if args.receipts:
+            #about as wide as the images preprocess works on
+            gray_img = np.array(synthetic_receipt.render(rng, width=1200, noise=0.03)[0].convert("L"))
+        else:
+            gray_img = synthetic_text(rng)
+        #
+        threshold_img = threshold(rotate_white(gray_img, true_angle))
+
+        for name, estimate in (("old", lambda img: old_estimate(img, args.osd)), ("new", lambda img: new_estimate(img, decided))):
+            start = time.perf_counter()
+            correction = estimate(threshold_img)
+            results[name][0].append(time.perf_counter() - start)
+            results[name][1].append(angle_error(true_angle, correction))
+        #
+    #
+    for name, (times, errors) in results.items():
+        errors = np.array(errors)
+        print(f"{name}: {np.mean(times)*1000:7.1f} ms/image, "
+            f"median error {np.median(errors):6.2f} deg, within 1 deg: {np.mean(errors <= 1)*100:5.1f} %")
+    #
+    print(f"new: up/down decided without osd for {np.mean(decided)*100:5.1f} % of images")
+#
+if __name__ == "__main__":
+    main()
+#
@@ -0,0 +1,159 @@
+import collections
+import threading
+import time
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+#camera preview shared by both camera scripts (image_capture.py and image_capture_rpi.py)
+#the capture thread puts frames into a Frame_slot, the tk main loop takes them out with after() at most preview_fps times a second
+#so no thread spins while waiting for frames, and tk is only ever called from the main loop
+
+preview_fps = 30 #max preview frames shown per second
+poll_interval = 5 #ms between checks for a new frame when the slot is empty
+counter_interval = 1.0 #seconds between updates of the fps and dropped frames counters
+preview_interpolation = cv2.INTER_LINEAR #cheap resize for live frames, stills shown by image_gui still use bicubic
+
+#bounded frame buffer between the capture thread and the tk main loop
+#when it's full the oldest frame is dropped, so the preview always shows the newest frames and never falls behind the camera
+#drop(frame) is called for dropped frames, e.g. to give a camera buffer back
+class Frame_slot():
+    def __init__(self, size=1, drop=None):
+        self.lock = threading.Lock()
+        self.frames = collections.deque(maxlen=size)
+        self.drop = drop
+        self.added = 0
+        self.dropped = 0 #frames replaced before they were shown
+    #
+    def put(self, frame):
+        old = None
+        with self.lock:
+            if len(self.frames) == self.frames.maxlen:
+                old = self.frames.popleft()
+                self.dropped += 1
+            #
+            self.frames.append(frame)
+            self.added += 1
+        #
+        if old is not None and self.drop:
+            self.drop(old)
+        #
+    #
+    #oldest frame in the slot, or None if there are none
+    def get(self):
+        with self.lock:
+            return self.frames.popleft() if self.frames else None
+        #
+    #
+#
+#takes frames from the slot on the tk main loop and shows them with show(frame)
+#master is the main window, the counters are shown in its info text
+class Preview_loop():
+    def __init__(self, master, show, fps=None, drop=None):
+        self.master = master
+        self.show = show
+        self.interval = 1 / (fps or preview_fps)
+        self.slot = Frame_slot(drop=drop)
+        self.running = False
+        self.after_id = None
+        self.shown = 0
+    #
+    #start showing frames, call from the main loop
+    def start(self):
+        self.running = True
+        self.next_time = self.counter_time = time.perf_counter()
+        self.counter_shown = self.shown
+        self.tick()
+    #
+    #stop showing frames, call from the main loop
+    def stop(self):
+        self.running = False
+        if self.after_id:
+            self.master.after_cancel(self.after_id)
+            self.after_id = None
+        #
+    #
+    def tick(self):
+        self.after_id = None
+        if not self.running:
+            return
+        #
+        #a frame is shown as soon as it arrives, but at most every interval
+        #checking on a fixed interval instead would miss frames that arrive just after the check whenever the camera has the same rate
+        frame = self.slot.get()
+        now = time.perf_counter()
+        if frame is not None:
+            self.show(frame)
+            self.shown += 1
+            #keep a steady pace, but don't try to catch up after a slow frame
+            self.next_time = max(self.next_time + self.interval, now)
+        #
+        if now - self.counter_time >= counter_interval:
+            fps = (self.shown - self.counter_shown) / (now - self.counter_time)
+            self.master.info_message.set(f"{fps:.1f} fps, {self.slot.dropped} frames dropped")
+            self.counter_time, self.counter_shown = now, self.shown
+        #
+        wait = int((self.next_time - time.perf_counter()) * 1000)
+        self.after_id = self.master.after(max(poll_interval, wait), self.tick)
+    #
+#
+#draws camera frames into a tkinter label, fitted to the available area like ImageOps.contain
+#the color converted frame, the resized frame and the PhotoImage are made once and reused for every frame,
+#they are only made again when the frame size or the area changes
+#the resized frame is RGBA because PIL can only share the memory of 4 channel arrays (with an RGB array fromarray would copy it)
+class Frame_renderer():
+    def __init__(self, label, conversion):
+        self.label = label
+        self.conversion = conversion #cv2 color conversion from camera frames to RGBA, e.g. cv2.COLOR_BGR2RGBA
+        self.frame_shape = None
+        self.area = None
+        self.rgba = None
+    #
+    #runs on the tk main loop, area is the (width, height) to fit the frame into
+    def show(self, frame, area):
+        if frame.shape != self.frame_shape:
+            self.frame_shape = frame.shape
+            self.rgba = None
+            self.area = None
+        #
+        self.rgba = cv2.cvtColor(frame, self.conversion, dst=self.rgba)
+        if area != self.area:
+            self.area = area
+            self.allocate(area)
+        #
+        cv2.resize(self.rgba, self.size, dst=self.resized, interpolation=preview_interpolation)
+        self.photo.paste(self.image)
+    #
+    #make the buffers and the PhotoImage for a new area
+    def allocate(self, area):
+        height, width = self.rgba.shape[:2]
+        scale = min(area[0] / width, area[1] / height)
+        self.size = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+        self.resized = np.empty((self.size[1], self.size[0], 4), np.uint8)
+        self.image = Image.frombuffer("RGBA", self.size, self.resized, "raw", "RGBA", 0, 1) #shares memory with self.resized
+        self.photo = ImageTk.PhotoImage("RGBA", self.size, width=self.size[0], height=self.size[1])
+
+        self.label.configure(width=area[0], height=area[1], image=self.photo)
+        self.label.image = self.photo #hack to prevent garbage collection
+    #
+#
+#run func in a thread and call done(result) on the tk main loop when it has finished, result is None if func failed
+#for slow camera calls (opening the camera, capturing a still) that would freeze the window
+def run_in_thread(master, func, done, interval=20):
+    result = [None]
+    def target():
+        result[0] = func()
+    #
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+
+    def check():
+        if thread.is_alive():
+            master.after(interval, check)
+        else:
+            done(result[0])
+        #
+    #
+    master.after(interval, check)
+#
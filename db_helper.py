@@ -1,108 +1,577 @@
 import sqlite3
 from datetime import datetime
 import os.path
+import json
+import threading
+import weakref
+
+#own scripts
+import metrics
 
 fetch_amount = 1000 #how many rows max per request
 db_name = "receipt.db"
 
+#connection settings
+busy_timeout = 10.0 #seconds to wait for another writer before giving up with "database is locked"
+statement_cache = 64 #prepared statements kept per connection, every query here is reused as-is
+cache_size_kib = 8192 #page cache per connection
+
 #adapt datetime.datetime to timezone-naive ISO 8601 date
 #have to specify because the default adapter is deprecated in sqlite3
 def adapt_datetime_iso(val):
     return val.isoformat()
 #
+sqlite3.register_adapter(datetime, adapt_datetime_iso)
+
+#every thread (GUI, text detection, batch writer) keeps its own long-lived connection
+#WAL lets readers and the single writer work at the same time instead of locking each other out
+#a thread's connection is closed when the thread ends, short-lived threads (fetches, saves) don't leave theirs open
+local = threading.local()
+connections = set() #every open connection, so close() can close them all
+schema_ready = set() #databases whose tables have been checked by this process
+connection_lock = threading.Lock()
+
 #check if the .db file exists
 def exists():
     return os.path.isfile(db_name)
 #
+#holds a thread's connection in local, python drops it when the thread ends and the finalizer closes the connection
+#(sqlite3 connections can't be weakly referenced themselves)
+class Thread_connection():
+    def __init__(self, con):
+        self.con = con
+        weakref.finalize(self, close_connection, con, os.getpid())
+    #
+#
+#no connection_lock here, the finalizer can run while close() holds it, set.discard is atomic on its own
+def close_connection(con, pid):
+    #a forked child must not close (and checkpoint) its parent's connection, it stays in connections untouched
+    if os.getpid() != pid:
+        return
+    #
+    try:
+        con.close()
+    except sqlite3.ProgrammingError:
+        pass #closed from another thread, e.g. close() while the thread was still running
+    #
+    connections.discard(con)
+#
+#return this thread's connection, opened and set up on first use
+#a new one is opened if db_name changed or the process was forked (connections can't cross a fork)
+def connect():
+    key = (db_name, os.getpid())
+    if getattr(local, "key", None) == key:
+        return local.holder.con
+    #
+    con = sqlite3.connect(db_name, timeout=busy_timeout, cached_statements=statement_cache, check_same_thread=False)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL") #safe with WAL, syncs at checkpoints instead of every commit
+    con.execute("PRAGMA temp_store=MEMORY")
+    con.execute(f"PRAGMA cache_size=-{cache_size_kib}")
+    con.execute(f"PRAGMA busy_timeout={int(busy_timeout * 1000)}")
+
+    with connection_lock:
+        connections.add(con)
+        if db_name not in schema_ready:
+            create_tables(con)
+            schema_ready.add(db_name)
+        #
+    #
+    #replacing an older holder (db_name changed) closes that connection
+    local.holder, local.key = Thread_connection(con), key
+    return con
+#
+#close every connection, e.g. when the app exits, they are opened again when needed
+def close():
+    global local
+    with connection_lock:
+        for con in list(connections):
+            try:
+                con.close()
+            except sqlite3.ProgrammingError:
+                pass #already closed
+            #
+        #
+        connections.clear()
+        schema_ready.clear()
+        local = threading.local()
+    #
+#
 #create the database if it doesn't exist
 #doesn't modify the tables even if it does exist
 def create_db():
-    con = sqlite3.connect(db_name)
-    sqlite3.register_adapter(datetime, adapt_datetime_iso)
-    cur = con.cursor()
-    
-    cur.execute('''
+    connect()
+#
+def create_tables(con):
+    #one transaction for everything, IMMEDIATE makes other processes wait while the tables are checked
+    with con:
+        con.execute("BEGIN IMMEDIATE")
+        run_script(con, tables)
+
+        #changes that fill tables from existing receipts or change existing tables are migrations, run once per database
+        #PRAGMA user_version stores how many have been run
+        version = con.execute("PRAGMA user_version").fetchone()[0]
+        if version < len(migrations):
+            for script in migrations[version:]:
+                run_script(con, script)
+            #
+            con.execute(f"PRAGMA user_version = {len(migrations)}")
+        #
+    #
+#
+#run every statement of an sql script, unlike executescript this stays in the current transaction
+def run_script(con, script):
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            con.execute(statement)
+            statement = ""
+        #
+    #
+#
+tables = '''
     CREATE TABLE IF NOT EXISTS receipt(
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     entry_date_time TEXT NOT NULL,
     receipt_date_time TEXT,
     price REAL NOT NULL,
     vat REAL NOT NULL
-    )''')
-    
-    con.commit()
-    con.close()
+    );
+
+    --indexes for paging in other orders than id (see get_page), receipts without a date sort first
+    CREATE INDEX IF NOT EXISTS receipt_date_index ON receipt(COALESCE(receipt_date_time, ''), id);
+    CREATE INDEX IF NOT EXISTS receipt_price_index ON receipt(price, id);
+
+    --per-stage timings from text recognition and the database (see metrics.py)
+    CREATE TABLE IF NOT EXISTS metrics(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    time TEXT NOT NULL,
+    run TEXT,
+    pid INTEGER,
+    stage TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    peak_rss INTEGER, --renamed to process_peak_rss by migration 4
+    extra TEXT
+    );
+
+    --image files saved by watch_app.py, by a hash of the file contents, so the same scan is never read twice
+    --status is "saved" (receipt_id is the saved receipt) or why the result couldn't be saved
+    CREATE TABLE IF NOT EXISTS ingested(
+    hash TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    time TEXT NOT NULL,
+    status TEXT NOT NULL,
+    receipt_id INTEGER
+    );
+    '''
+
+#sql that adds (sign "") or removes (sign "-") one receipt row ("NEW" or "OLD" in a trigger) from the summary tables
+#receipts without a date count towards the day they were saved
+#the vat amount assumes the whole price has the receipt's vat rate: price * vat / (100 + vat)
+def summary_upserts(row, sign):
+    date = f"COALESCE({row}.receipt_date_time, {row}.entry_date_time)"
+    values = f"{sign}1, {sign}{row}.price, {sign}{row}.price * {row}.vat / (100 + {row}.vat)"
+    update = "receipts = receipts + excluded.receipts, total = total + excluded.total, vat_total = vat_total + excluded.vat_total"
+    return f'''
+        INSERT INTO summary_day VALUES(substr({date}, 1, 10), {values}) ON CONFLICT(day) DO UPDATE SET {update};
+        INSERT INTO summary_month VALUES(substr({date}, 1, 7), {values}) ON CONFLICT(month) DO UPDATE SET {update};
+        INSERT INTO summary_vat VALUES(substr({date}, 1, 7), {row}.vat, {values}) ON CONFLICT(month, rate) DO UPDATE SET {update};'''
+#
+#sql that fills a summary table from every receipt, group_by is the key column numbers, e.g. "1, 2"
+def summary_fill(table, keys, group_by):
+    return f'''
+    INSERT INTO {table}
+    SELECT {keys}, COUNT(*), SUM(price), SUM(price * vat / (100 + vat)) FROM receipt GROUP BY {group_by};'''
 #
+migrations = [
+    #1: row count kept up to date by triggers, COUNT(*) has to go through the whole table
+    '''
+    CREATE TABLE IF NOT EXISTS receipt_count(
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    rows INTEGER NOT NULL
+    );
+    INSERT OR REPLACE INTO receipt_count SELECT 0, COUNT(*) FROM receipt;
+    CREATE TRIGGER IF NOT EXISTS receipt_count_insert AFTER INSERT ON receipt BEGIN
+        UPDATE receipt_count SET rows = rows + 1 WHERE id = 0;
+    END;
+    CREATE TRIGGER IF NOT EXISTS receipt_count_delete AFTER DELETE ON receipt BEGIN
+        UPDATE receipt_count SET rows = rows - 1 WHERE id = 0;
+    END;
+    ''',
+    #2: spending per day, per month and per vat rate and month, kept up to date by triggers
+    #so reports (get_spending, get_vat_breakdown, get_totals) never have to go through the receipt table
+    '''
+    CREATE TABLE IF NOT EXISTS summary_day(
+    day TEXT PRIMARY KEY,
+    receipts INTEGER NOT NULL,
+    total REAL NOT NULL,
+    vat_total REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS summary_month(
+    month TEXT PRIMARY KEY,
+    receipts INTEGER NOT NULL,
+    total REAL NOT NULL,
+    vat_total REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS summary_vat(
+    month TEXT NOT NULL,
+    rate REAL NOT NULL,
+    receipts INTEGER NOT NULL,
+    total REAL NOT NULL,
+    vat_total REAL NOT NULL,
+    PRIMARY KEY (month, rate)
+    );
+    '''
+    + summary_fill("summary_day", "substr(COALESCE(receipt_date_time, entry_date_time), 1, 10)", "1")
+    + summary_fill("summary_month", "substr(COALESCE(receipt_date_time, entry_date_time), 1, 7)", "1")
+    + summary_fill("summary_vat", "substr(COALESCE(receipt_date_time, entry_date_time), 1, 7), vat", "1, 2")
+    + f'''
+    CREATE TRIGGER IF NOT EXISTS summary_insert AFTER INSERT ON receipt BEGIN{summary_upserts("NEW", "")}
+    END;
+    CREATE TRIGGER IF NOT EXISTS summary_delete AFTER DELETE ON receipt BEGIN{summary_upserts("OLD", "-")}
+    END;
+    CREATE TRIGGER IF NOT EXISTS summary_update AFTER UPDATE OF entry_date_time, receipt_date_time, price, vat ON receipt BEGIN{summary_upserts("OLD", "-")}{summary_upserts("NEW", "")}
+    END;
+    ''',
+    #3: raw OCR text of every receipt, with a full-text index for search()
+    #the index only stores the words (external content), the text itself is in the receipt table
+    #remove_diacritics lets "kaytto" find "käyttö", prefix indexes make search-as-you-type prefixes fast
+    #every row has to be in the index (even without text) for the delete triggers to work, so existing rows are indexed once
+    '''
+    ALTER TABLE receipt ADD COLUMN raw_text TEXT;
+    CREATE VIRTUAL TABLE IF NOT EXISTS receipt_search USING fts5(
+    raw_text, content='receipt', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    );
+    INSERT INTO receipt_search(receipt_search) VALUES('rebuild');
+    CREATE TRIGGER IF NOT EXISTS receipt_search_insert AFTER INSERT ON receipt BEGIN
+        INSERT INTO receipt_search(rowid, raw_text) VALUES(NEW.id, NEW.raw_text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS receipt_search_delete AFTER DELETE ON receipt BEGIN
+        INSERT INTO receipt_search(receipt_search, rowid, raw_text) VALUES('delete', OLD.id, OLD.raw_text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS receipt_search_update AFTER UPDATE OF raw_text ON receipt BEGIN
+        INSERT INTO receipt_search(receipt_search, rowid, raw_text) VALUES('delete', OLD.id, OLD.raw_text);
+        INSERT INTO receipt_search(rowid, raw_text) VALUES(NEW.id, NEW.raw_text);
+    END;
+    ''',
+    #4: the rss column of the metrics table is the high-water mark of the whole process, not of one stage
+    '''
+    ALTER TABLE metrics RENAME COLUMN peak_rss TO process_peak_rss;
+    ''',
+]
+
 #convert the data from text recognition to be suitable for inserting into databse
-def convert_data(data):
+#one result becomes an (entry date, receipt date, price, vat, raw text) row, the raw OCR text ("text") is optional
+#raises ValueError with the reason if the data is invalid
+def convert_row(data):
     #incoming data = date_time, price, vat (only receipt date is allowed to be null)
-    cd = []
-    
+    try:
+        date_time, price, vat = data["date_time"], data["price"], data["vat"]
+    except (KeyError, TypeError):
+        raise ValueError("not a result with date_time, price and vat") from None
+    #
+    if price is None or vat is None:
+        raise ValueError("price not found" if price is None else "vat not found")
+    #
     #add trailing ":00" if needed and convert to datetime format
-    if data["date_time"]:
-        if len(data["date_time"]) < 18:
-            data["date_time"] += ":00"
+    receipt_date = None
+    if date_time:
+        if len(date_time) < 18:
+            date_time += ":00"
+        #
+        try:
+            receipt_date = datetime.strptime(date_time, "%d.%m.%Y %H:%M:%S")
+        except ValueError:
+            raise ValueError(f"invalid date {data['date_time']!r}") from None
         #
-        receipt_date = datetime.strptime(data["date_time"], "%d.%m.%Y %H:%M:%S")
-    else:
-        receipt_date = None
     #
-    #create data list
-    data_item = (datetime.now(), receipt_date, float(data["price"]), float(data["vat"]))
-    cd.append(data_item)
-    
-    return cd
-#
-#insert one row of data into database
-def add_row(data):  
-    if not exists():
-        create_db()
-    #try to convert data, if invalid, return false
     try:
-        c_data = convert_data(data)
-    except Exception:
-        return False
-        pass
+        price, vat = float(price), float(vat)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid number in price {price!r} or vat {vat!r}") from None
     #
-    con = sqlite3.connect(db_name)
-    sqlite3.register_adapter(datetime, adapt_datetime_iso)
-    cur = con.cursor()
+    return (datetime.now(), receipt_date, price, vat, data.get("text"))
+#
+#statements used over and over, sqlite3 keeps them prepared per connection (keyed by the exact text)
+insert_receipt = "INSERT INTO receipt(entry_date_time, receipt_date_time, price, vat, raw_text) VALUES(?, ?, ?, ?, ?)"
+insert_metrics = "INSERT INTO metrics VALUES(null, ?, ?, ?, ?, ?, ?, ?)"
+insert_ingested = "INSERT OR REPLACE INTO ingested VALUES(?, ?, ?, ?, ?)"
 
-    #Data needs to be (datetime, datetime, float, int), can accept multiple rows
-    cur.executemany("INSERT INTO receipt VALUES(null, ?, ?, ?, ?)", c_data)
-    
-    con.commit()   
-    con.close()
-    
-    return True
-#
-#return next max {fetch_amount} of rows from the database
-def get_rows(offset):
-    rows = None
-    con = sqlite3.connect(db_name)
-    sqlite3.register_adapter(datetime, adapt_datetime_iso)
-    cur = con.cursor()
-
-    cur.execute('''
-    SELECT id, STRFTIME('%d.%m.%Y %H:%M:%S', entry_date_time), STRFTIME('%d.%m.%Y %H:%M:%S', receipt_date_time), price, vat 
-    FROM receipt 
-    ORDER BY id LIMIT ? OFFSET ?
-    ''', (fetch_amount, fetch_amount * offset))
-    
-    rows = cur.fetchall()
-    con.close()
+#orders the database view can be paged in, column name: sort expression (must match the indexes)
+sort_keys = {
+    "id": "id",
+    "receipt_date_time": "COALESCE(receipt_date_time, '')",
+    "price": "price",
+}
 
-    return rows
+#insert one row of data into database, returns False if the data is invalid
+def add_row(data):
+    return not add_rows([data])
 #
-#count how many entries total in database
-def count():
-    con = sqlite3.connect(db_name)
-    cur = con.cursor()
+#how many rows are inserted with one executemany and committed together
+chunk_size = 1000
+
+#insert any number of results (a list or any iterable, e.g. a generator reading files), a chunk at a time
+#every chunk is one transaction, so a big import doesn't wait for one disk sync per row
+#returns the rows that weren't saved as a list of (index in data_list, reason)
+def add_rows(data_list):
+    rejected = []
+    chunk = [] #(index, converted row)
+    for index, data in enumerate(data_list):
+        try:
+            chunk.append((index, convert_row(data)))
+        except ValueError as error:
+            rejected.append((index, str(error)))
+        #
+        if len(chunk) >= chunk_size:
+            rejected += insert_chunk(chunk)
+            chunk = []
+        #
+    #
+    if chunk:
+        rejected += insert_chunk(chunk)
+    #
+    rejected.sort()
+    return rejected
+#
+#insert converted rows in one transaction, returns rejected (index, reason)
+#if the database refuses the chunk, it's rolled back and retried row by row to find the bad ones
+def insert_chunk(chunk):
+    con = connect()
+    with metrics.stage("db_insert", rows=len(chunk)):
+        try:
+            with con:
+                con.executemany(insert_receipt, [row for _, row in chunk])
+            #
+            return []
+        except sqlite3.IntegrityError:
+            pass
+        #
+        rejected = []
+        with con:
+            for index, row in chunk:
+                try:
+                    con.execute(insert_receipt, row)
+                except sqlite3.IntegrityError as error:
+                    rejected.append((index, str(error)))
+                #
+            #
+        #
+        return rejected
+    #
+#
+#save the results of image files together with the hash of each file's contents, all in one transaction
+#files is a list of (hash, file path, result), results that can't be saved are recorded with the reason, so the file isn't read again either
+#returns the rows that weren't saved as a list of (index in files, reason)
+def add_files(files):
+    rejected = []
+    con = connect()
+    with metrics.stage("db_insert", rows=len(files)):
+        with con:
+            for index, (digest, path, result) in enumerate(files):
+                receipt_id, status = None, "saved"
+                try:
+                    receipt_id = con.execute(insert_receipt, convert_row(result)).lastrowid
+                except (ValueError, sqlite3.IntegrityError) as error:
+                    status = str(error)
+                    rejected.append((index, status))
+                #
+                con.execute(insert_ingested, (digest, path, datetime.now(), status, receipt_id))
+            #
+        #
+    #
+    return rejected
+#
+#True if an image file with this content hash has already been handled by add_files
+def ingested(digest):
+    return connect().execute("SELECT 1 FROM ingested WHERE hash = ?", (digest,)).fetchone() is not None
+#
+#save timing records from metrics.Db_sink, fields without their own column go into "extra" as json
+def add_metrics(records):
+    columns = ("run", "pid", "stage", "seconds", "process_peak_rss")
+    rows = []
+    for record in records:
+        extra = {k: v for k, v in record.items() if k not in columns and k != "time"}
+        rows.append((datetime.fromtimestamp(record["time"]).isoformat(), *(record.get(c) for c in columns), json.dumps(extra) if extra else None))
+    #
+    con = connect()
+    with con:
+        con.executemany(insert_metrics, rows)
+    #
+#
+#columns shown in the database view, plus the sort value for building keys
+select_view = """
+    SELECT id, STRFTIME('%d.%m.%Y %H:%M:%S', entry_date_time), STRFTIME('%d.%m.%Y %H:%M:%S', receipt_date_time), price, vat, {sort}
+    FROM receipt
+    """
+
+#return one page of max {size} rows (default fetch_amount), sorted by a column in sort_keys
+#pages are found by key (keyset pagination) instead of skipping rows, so the last page is as fast as the first
+#key is where the page continues from: the last key of the previous page, or the first key when going backward
+#with key None the first page is returned, or the last page if backward
+#returns (rows, first_key, last_key), the keys are None if there are no rows
+def get_page(sort="id", descending=False, key=None, backward=False, size=None):
+    #rows are compared by (sort value, id), so rows with the same value aren't skipped
+    columns = key_columns(sort)
+    reverse = descending != backward #walk the index from the other end
     
-    cur.execute("SELECT COUNT(*) FROM receipt")
-    amount = cur.fetchall() 
+    query = select_view.format(sort=columns[0])
+    params = []
+    if key is not None:
+        compare = "<" if reverse else ">"
+        query += f"WHERE ({', '.join(columns)}) {compare} ({', '.join('?' * len(columns))})\n"
+        params += key
+        if len(columns) > 1:
+            #sqlite only jumps straight to the key in an expression index with a plain comparison on the first column
+            query += f"AND {columns[0]} {compare}= ?\n"
+            params.append(key[0])
+        #
+    #
+    query += "ORDER BY " + order_sql(columns, reverse) + " LIMIT ?"
+    params.append(size or fetch_amount)
     
-    con.close()
-    #sqlite3 always returns an array of tuples, so [0][0] returns only the value
-    return amount[0][0] 
-#
\ No newline at end of file
+    rows = connect().execute(query, params).fetchall()
+    if backward:
+        rows.reverse()
+    #
+    return page_result(rows, sort)
+#
+#return max {size} rows starting from a position, for jumping anywhere (e.g. dragging the scrollbar)
+#only the index is skipped through, not the rows, but it still grows with the position, get_page is faster for the next rows
+#returns (rows, first_key, last_key) like get_page
+def get_rows_at(sort="id", descending=False, start=0, size=None):
+    columns = key_columns(sort)
+    order = order_sql(columns, descending)
+    query = select_view.format(sort=columns[0]) + f"WHERE id IN (SELECT id FROM receipt ORDER BY {order} LIMIT ? OFFSET ?) ORDER BY {order}"
+    rows = connect().execute(query, (size or fetch_amount, start)).fetchall()
+    return page_result(rows, sort)
+#
+#sort expressions a key is made of
+def key_columns(sort):
+    return ["id"] if sort == "id" else [sort_keys[sort], "id"]
+#
+def order_sql(columns, reverse):
+    return ", ".join(c + (" DESC" if reverse else "") for c in columns)
+#
+#split the query result into the shown rows and the keys of the first and last row
+def page_result(rows, sort):
+    if not rows:
+        return [], None, None
+    #
+    keys = [(row[0],) if sort == "id" else (row[5], row[0]) for row in (rows[0], rows[-1])]
+    return [row[:5] for row in rows], keys[0], keys[1]
+#
+#count how many entries total in database, kept in the receipt_count table so it doesn't depend on the size
+def count():
+    #sqlite3 always returns tuples, so [0] returns only the value
+    return connect().execute("SELECT rows FROM receipt_count WHERE id = 0").fetchone()[0]
+#
+#go through receipts in id order without loading them all into memory, for exporting (see export.py)
+#start and end ("yyyy-mm-dd", both included) limit the receipt date, receipts without a date count towards the day they were saved like in the summaries
+#after_id only returns receipts saved after that one, ids are never reused so that is everything added since
+#yields lists of max {size} (default fetch_amount) (id, entry date, receipt date, price, vat[, raw text]) rows, dates as saved (ISO 8601)
+#every list comes from the same query, so the receipts are from one point in time even if others are saved meanwhile
+def iter_receipts(start=None, end=None, after_id=0, text=False, size=None):
+    day = "substr(COALESCE(receipt_date_time, entry_date_time), 1, 10)"
+    cursor = connect().execute(f"""
+    SELECT id, entry_date_time, receipt_date_time, price, vat{", raw_text" if text else ""} FROM receipt
+    WHERE id > ? AND {day} >= COALESCE(?, '') AND {day} <= COALESCE(?, '9999')
+    ORDER BY id
+    """, (after_id, start, end))
+    try:
+        while True:
+            rows = cursor.fetchmany(size or fetch_amount)
+            if not rows:
+                break
+            #
+            yield rows
+        #
+    finally:
+        cursor.close()
+    #
+#
+#spending per day or per month, oldest first: [(day or month, receipts, total, vat)]
+#start and end limit the range (both included), "yyyy-mm-dd" for days and "yyyy-mm" for months
+#comes from the summary tables, so it's fast for any number of receipts
+def get_spending(period="month", start=None, end=None):
+    if period not in ("day", "month"):
+        raise ValueError(f"unknown period {period!r}")
+    #
+    return connect().execute(f"""
+    SELECT {period}, receipts, ROUND(total, 2), ROUND(vat_total, 2) FROM summary_{period}
+    WHERE receipts > 0 AND {period} >= COALESCE(?, '') AND {period} <= COALESCE(?, '9999')
+    ORDER BY {period}
+    """, (start, end)).fetchall()
+#
+#vat per rate, lowest rate first: [(rate, receipts, total, vat)], optionally only for months start to end ("yyyy-mm")
+def get_vat_breakdown(start=None, end=None):
+    return connect().execute("""
+    SELECT rate, SUM(receipts), ROUND(SUM(total), 2), ROUND(SUM(vat_total), 2) FROM summary_vat
+    WHERE month >= COALESCE(?, '') AND month <= COALESCE(?, '9999')
+    GROUP BY rate HAVING SUM(receipts) > 0 ORDER BY rate
+    """, (start, end)).fetchall()
+#
+#number of receipts, total spending and vat for months start to end ("yyyy-mm"), or everything
+def get_totals(start=None, end=None):
+    return connect().execute("""
+    SELECT COALESCE(SUM(receipts), 0), ROUND(COALESCE(SUM(total), 0), 2), ROUND(COALESCE(SUM(vat_total), 0), 2) FROM summary_month
+    WHERE month >= COALESCE(?, '') AND month <= COALESCE(?, '9999')
+    """, (start, end)).fetchone()
+#
+#find receipts by the words in their raw OCR text, best matches first (bm25)
+#every word has to be found, words also match as prefixes ("hard" finds "hardware"), so any typed text is a valid query
+#returns [(id, entry date, receipt date, price, vat, snippet)] with the matching words in the snippet marked with [ ]
+def search(text, limit=1000):
+    words = ['"' + word.replace('"', '""') + '"*' for word in text.split()]
+    if not words:
+        return []
+    #
+    return connect().execute("""
+    SELECT receipt.id, STRFTIME('%d.%m.%Y %H:%M:%S', entry_date_time), STRFTIME('%d.%m.%Y %H:%M:%S', receipt_date_time), price, vat,
+    snippet(receipt_search, 0, '[', ']', '...', 8)
+    FROM receipt_search JOIN receipt ON receipt.id = receipt_search.rowid
+    WHERE receipt_search MATCH ? ORDER BY rank LIMIT ?
+    """, (" ".join(words), limit)).fetchall()
+#
+#save raw texts for receipts that are already in the database, from (id, text) pairs, chunk_size rows per transaction
+#the search index is updated by a trigger
+def set_raw_texts(pairs):
+    con = connect()
+    chunk = []
+    for receipt_id, text in pairs:
+        chunk.append((text, receipt_id))
+        if len(chunk) >= chunk_size:
+            with con:
+                con.executemany("UPDATE receipt SET raw_text = ? WHERE id = ?", chunk)
+            #
+            chunk = []
+        #
+    #
+    if chunk:
+        with con:
+            con.executemany("UPDATE receipt SET raw_text = ? WHERE id = ?", chunk)
+        #
+    #
+#
+#index every receipt's raw text again from scratch and merge the index into as few parts as possible
+#for rows saved with raw text while the index didn't exist (or if the index is out of date for any reason)
+def rebuild_search():
+    con = connect()
+    with con:
+        con.execute("INSERT INTO receipt_search(receipt_search) VALUES('rebuild')")
+        con.execute("INSERT INTO receipt_search(receipt_search) VALUES('optimize')")
+    #
+#
+#rebuild the search index: python db_helper.py rebuild-search
+if __name__ == "__main__":
+    import sys, time
+
+    if sys.argv[1:] == ["rebuild-search"]:
+        start = time.perf_counter()
+        rebuild_search()
+        print(f"search index rebuilt for {count()} receipts in {time.perf_counter() - start:.1f}s")
+    else:
+        print("usage: python db_helper.py rebuild-search")
+    #
+#
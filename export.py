@@ -0,0 +1,193 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None #only needed for parquet and arrow files
+
+#own scripts
+import db_helper as db
+
+#export receipts for bookkeeping into csv, parquet or arrow files
+#rows are streamed from the database a chunk at a time, so memory use is the same for any number of receipts
+#usage: python export.py <output file> [--start yyyy-mm-dd] [--end yyyy-mm-dd] [--since-last] [--text]
+
+columns = ("id", "entry_date_time", "receipt_date_time", "price", "vat")
+formats = {".csv": "csv", ".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow"} #file extension: format
+chunk_size = 10000 #rows fetched and written at once, also the parquet row group size
+state_path = "export_state.json" #id of the last exported receipt, for exporting only new ones
+
+#dates as saved in the database (ISO 8601), which spreadsheets and accounting software read as dates
+class Csv_writer():
+    def __init__(self, path, names):
+        self.file = open(path, "w", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(names)
+    #
+    def write(self, rows):
+        self.writer.writerows(rows)
+    #
+    def close(self):
+        self.file.close()
+    #
+#
+#every chunk becomes one row group
+class Parquet_writer():
+    def __init__(self, path, names):
+        self.schema = arrow_schema(names)
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+    #
+    def write(self, rows):
+        self.writer.write_table(pyarrow.Table.from_batches([arrow_batch(rows, self.schema)]))
+    #
+    def close(self):
+        self.writer.close()
+    #
+#
+#arrow ipc file (also known as feather v2), every chunk becomes one record batch
+class Arrow_writer():
+    def __init__(self, path, names):
+        self.schema = arrow_schema(names)
+        self.file = pyarrow.OSFile(path, "wb")
+        self.writer = pyarrow.ipc.new_file(self.file, self.schema)
+    #
+    def write(self, rows):
+        self.writer.write_batch(arrow_batch(rows, self.schema))
+    #
+    def close(self):
+        self.writer.close()
+        self.file.close()
+    #
+#
+writers = {"csv": Csv_writer, "parquet": Parquet_writer, "arrow": Arrow_writer}
+
+#parquet and arrow columns are typed, dates become timestamps
+def arrow_schema(names):
+    types = {
+        "id": pyarrow.int64(),
+        "entry_date_time": pyarrow.timestamp("us"),
+        "receipt_date_time": pyarrow.timestamp("us"),
+        "price": pyarrow.float64(),
+        "vat": pyarrow.float64(),
+        "raw_text": pyarrow.string(),
+    }
+    return pyarrow.schema([(name, types[name]) for name in names])
+#
+#turn database rows into columns
+def arrow_batch(rows, schema):
+    arrays = []
+    for index, field in enumerate(schema):
+        values = [row[index] for row in rows]
+        if pyarrow.types.is_timestamp(field.type):
+            values = [None if value is None else datetime.fromisoformat(value) for value in values]
+        #
+        arrays.append(pyarrow.array(values, type=field.type))
+    #
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+#
+#export receipts into a file, returns how many were written
+#fmt is "csv", "parquet" or "arrow", by default it comes from the file extension
+#start and end ("yyyy-mm-dd", both included) limit the receipt date, text adds the raw OCR text as a column
+#since_last only exports receipts saved after the previous since_last export with the same state file
+#it can't be combined with start or end: the state is the last exported id, and receipts left out by the dates
+#can have lower ids than that (ids follow the order receipts were saved in, not their dates), so later exports would skip them
+#the file is written under a temporary name and renamed when it's complete, the state is only saved after that,
+#so an interrupted export leaves no half-written file and exports the same receipts again next time
+def export(path, fmt=None, start=None, end=None, since_last=False, text=False, state=state_path):
+    fmt = fmt or formats.get(os.path.splitext(path)[1].lower())
+    if fmt not in writers:
+        raise ValueError(f"unknown export format for {path!r}, use one of: {', '.join(writers)}")
+    #
+    if since_last and (start or end):
+        raise ValueError("--since-last can't be combined with --start or --end, receipts outside the dates would never be exported")
+    #
+    if fmt != "csv" and pyarrow is None:
+        raise RuntimeError(f"{fmt} export needs pyarrow (pip install pyarrow)")
+    #
+    after_id = load_state(state) if since_last else 0
+    names = columns + (("raw_text",) if text else ())
+
+    part = path + ".part"
+    writer = writers[fmt](part, names)
+    exported, last_id = 0, after_id
+    complete = False
+    try:
+        for rows in db.iter_receipts(start, end, after_id, text, chunk_size):
+            writer.write(rows)
+            exported += len(rows)
+            last_id = rows[-1][0]
+        #
+        complete = True
+    finally:
+        writer.close()
+        if not complete:
+            os.remove(part)
+        #
+    #
+    os.replace(part, path)
+    if since_last:
+        save_state(state, last_id)
+    #
+    return exported
+#
+#id of the last exported receipt, 0 if nothing has been exported yet
+def load_state(path=state_path):
+    if not os.path.isfile(path):
+        return 0
+    #
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["last_id"]
+    #
+#
+def save_state(path, last_id):
+    with open(path + ".part", "w", encoding="utf-8") as f:
+        json.dump({"last_id": last_id, "time": datetime.now().isoformat()}, f)
+    #
+    os.replace(path + ".part", path)
+#
+#argparse type for the date range, keeps the text so it can be compared with the saved dates
+def day(text):
+    try:
+        valid = datetime.strptime(text, "%Y-%m-%d").strftime("%Y-%m-%d") == text #strptime also takes e.g. 2020-1-1
+    except ValueError:
+        valid = False
+    #
+    if not valid:
+        raise argparse.ArgumentTypeError(f"{text!r} is not a yyyy-mm-dd date")
+    #
+    return text
+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="export receipts from the database into a csv, parquet or arrow file")
+    parser.add_argument("output", help="file to write, the format comes from the extension (.csv, .parquet, .arrow/.feather)")
+    parser.add_argument("--format", choices=tuple(writers), help="format if the extension doesn't tell it")
+    parser.add_argument("--start", type=day, help="first receipt date to export (yyyy-mm-dd)")
+    parser.add_argument("--end", type=day, help="last receipt date to export (yyyy-mm-dd)")
+    parser.add_argument("--since-last", action="store_true", help="only export receipts saved after the previous --since-last export")
+    parser.add_argument("--state", default=state_path, help="file that remembers the last exported receipt for --since-last")
+    parser.add_argument("--text", action="store_true", help="add the raw OCR text of every receipt as a column")
+    parser.add_argument("--db", default=db.db_name, help="database file")
+    args = parser.parse_args(argv)
+
+    db.db_name = args.db
+    start = time.perf_counter()
+    try:
+        exported = export(args.output, args.format, args.start, args.end, args.since_last, args.text, args.state)
+    except (ValueError, RuntimeError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    #
+    print(f"{exported} receipts exported to {args.output} in {time.perf_counter() - start:.1f}s")
+    return 0
+#
+if __name__ == "__main__":
+    sys.exit(main())
+#
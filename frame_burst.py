@@ -0,0 +1,71 @@
+import cv2
+import numpy as np
+
+#own scripts
+import metrics
+
+#burst capture shared by both camera scripts (image_capture.py and image_capture_rpi.py)
+#a few frames are taken in a row and only the sharpest one is used, a single blurry frame would mean a failed OCR and a retake
+
+burst_size = 5 #frames taken per picture, 1 turns bursts off
+score_width = 320 #frames are scored at this width, enough to tell blur apart, and fast for any camera resolution
+
+#ring buffer for the frames of one burst, made once for the frame size and reused after that
+class Burst():
+    def __init__(self, size=None):
+        self.size = size or burst_size
+        self.frames = None
+        self.small = None #grayscale copies of the frames at score_width, for scoring
+        self.resized = None
+        self.count = 0
+    #
+    def __len__(self):
+        return min(self.count, self.size)
+    #
+    def clear(self):
+        self.count = 0
+    #
+    #copy a frame into the ring, the oldest one is overwritten when it's full
+    #copying lets the camera reuse its own buffer for the next frame
+    def add(self, frame):
+        if self.frames is None or self.frames.shape[1:] != frame.shape or self.frames.dtype != frame.dtype:
+            self.frames = np.empty((self.size,) + frame.shape, frame.dtype)
+            self.small = None
+            self.count = 0
+        #
+        np.copyto(self.frames[self.count % self.size], frame)
+        self.count += 1
+    #
+    #sharpness of every frame in the ring: variance of the laplacian of a small grayscale copy
+    #blur and shake soften the edges of the text, so the sharpest frame has the highest variance
+    #the laplacian is calculated for the whole burst at once, a few milliseconds for 5 frames of 5 megapixels
+    def scores(self):
+        frames = self.frames[:len(self)]
+        height, width = frames.shape[1:3]
+        size = (min(score_width, width), max(3, round(height * min(score_width, width) / width)))
+        if self.small is None:
+            self.small = np.empty((self.size, size[1], size[0]), np.float32)
+            self.resized = None
+        #
+        for index, frame in enumerate(frames):
+            self.resized = cv2.resize(frame, size, dst=self.resized, interpolation=cv2.INTER_LINEAR)
+            self.small[index] = gray(self.resized)
+        #
+        small = self.small[:len(frames)]
+        laplacian = 4 * small[:, 1:-1, 1:-1] - small[:, :-2, 1:-1] - small[:, 2:, 1:-1] - small[:, 1:-1, :-2] - small[:, 1:-1, 2:]
+        return laplacian.reshape(len(frames), -1).var(axis=1)
+    #
+    #the sharpest frame of the burst, it stays in the ring, so use it before the next burst
+    def sharpest(self):
+        with metrics.stage("burst_score", frames=len(self)):
+            return self.frames[int(np.argmax(self.scores()))]
+        #
+    #
+#
+#grayscale of a BGR, BGRA or already gray frame
+def gray(frame):
+    if frame.ndim == 2:
+        return frame
+    #
+    return cv2.cvtColor(frame, cv2.COLOR_BGRA2GRAY if frame.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+#
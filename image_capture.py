@@ -1,9 +1,23 @@
-from PIL import Image, ImageTk, ImageOps
+from PIL import Image
 import threading
 import cv2
 import platform, time
 
+#own scripts
+import camera_preview
+import frame_burst
+import metrics
+
 max_res = (4000, 4000) #hack, try big res so it scales down to largest supported res by camera
+camera_index = 0
+
+#resolutions tried when a camera is first used, the camera picks the nearest one it supports for each
+probe_sizes = [(320, 240), (640, 480), (800, 600), (1024, 768), (1280, 720), (1280, 960), (1600, 1200), (1920, 1080), (2560, 1440), (2592, 1944), (3264, 2448), (3840, 2160), max_res]
+resolution_cache = {} #(camera index, capture api): supported resolutions, smallest first
+
+#preview with the full resolution stream instead of a smaller one, capturing is then instant but the preview can be slow
+full_res_preview = False
+still_timeout = 3.0 #seconds to wait for a full resolution frame after switching the resolution
 
 class Webcam():
     def __init__(self, master, win_size):
@@ -12,91 +26,156 @@ class Webcam():
         #variables
         self.cam = None
         self.thread_running = False
-        self.current_frame = None
-        self.previous_frame = None
+        self.frames_thread = None
+        self.last_frame = None #newest preview frame, captured right away when the preview already has the full resolution
+        self.shutter_time = None
+        self.preview = camera_preview.Preview_loop(master, self.show_preview_frame)
+        self.renderer = camera_preview.Frame_renderer(master.img_preview, cv2.COLOR_BGR2RGBA)
+        self.burst = frame_burst.Burst()
         
         #get operating system
         os = platform.platform()
         
         #setting the capture source manually initializes the camera faster
         if "Windows" in os:
-            self.cam = cv2.VideoCapture(0, cv2.CAP_DSHOW) #use directshow in windows
+            self.cam = cv2.VideoCapture(camera_index, cv2.CAP_DSHOW) #use directshow in windows
         elif "Linux" in os:
-            self.cam = cv2.VideoCapture(0, cv2.CAP_V4L2) #use v4l2 in linux
+            self.cam = cv2.VideoCapture(camera_index, cv2.CAP_V4L2) #use v4l2 in linux
         else: #mac, untested
-            self.cam = cv2.VideoCapture(0) #should default to any available capture source
+            self.cam = cv2.VideoCapture(camera_index) #should default to any available capture source
             #print("Other / Mac ?")
         #
-        self.change_size(win_size)
+        #the preview uses the smallest resolution that fills the window with the same shape as the full resolution,
+        #so the still shows the same view as the preview
+        self.resolutions = self.probe_resolutions()
+        self.still_res = self.resolutions[-1]
+        self.resolution = self.change_size(self.preview_resolution(win_size))
     #
-    #create seperate threads for getting camera frames and processing them
+    #find the resolutions the camera supports, once per camera, this runs before the camera starts streaming so it's fast
+    def probe_resolutions(self):
+        key = (camera_index, self.cam.getBackendName() if self.cam.isOpened() else None)
+        if key not in resolution_cache:
+            found = {self.change_size(size) for size in probe_sizes}
+            found.discard((0, 0))
+            resolution_cache[key] = sorted(found, key=lambda size: size[0] * size[1]) or [max_res]
+        #
+        return resolution_cache[key]
+    #
+    def preview_resolution(self, area):
+        if full_res_preview:
+            return self.still_res
+        #
+        #the full resolution is left out if there's anything smaller, many cameras only send a few frames a second with it
+        aspect = self.still_res[0] / self.still_res[1]
+        same_shape = [size for size in self.resolutions if abs(size[0] / size[1] - aspect) < 0.03]
+        same_shape = same_shape[:-1] or same_shape
+        for size in same_shape:
+            if size[0] >= area[0] or size[1] >= area[1]: #at least as big as it's shown
+                return size
+            #
+        #
+        return same_shape[-1]
+    #
+    #start a thread for getting camera frames, they are shown by the tk main loop (see camera_preview)
+    #call from the main loop
     def start_preview_thread(self):
         self.thread_running = True
-        get_frames_thread = threading.Thread(target=self.get_preview_frame)
-        get_frames_thread.start()
-        
-        show_frames_thread = threading.Thread(target=self.show_preview_frame)
-        show_frames_thread.start()
+        self.frames_thread = threading.Thread(target=self.get_preview_frame, daemon=True)
+        self.frames_thread.start()
+        self.preview.start()
     #
-    #get new frame from cv2 camera
+    #get new frames from cv2 camera, read() waits for the next frame so this doesn't spin
     def get_preview_frame(self):
         while self.thread_running:
             got_frame, frame = self.cam.read()
             if got_frame:
-                self.current_frame = frame
+                self.last_frame = frame
+                self.preview.slot.put(frame)
+            else:
+                time.sleep(0.01) #read fails right away if the camera is gone
             #
         #
     #
-    #process frame: convert cv2 frame to PIL and resize it to fit application window 
-    #then update main window tkinter label (seperate from image_gui refresh_image())
-    def show_preview_frame(self):
-        while self.thread_running:
-            temp_frame = self.current_frame
-            if temp_frame is not None and temp_frame is not self.previous_frame:
-                
-                new_size = self.master.get_size()
-                
-                new_frame = cv2.cvtColor(self.current_frame, cv2.COLOR_BGR2RGB)
-                new_frame = Image.fromarray(new_frame)
-                new_frame = ImageOps.contain(new_frame, new_size, method=Image.Resampling.BICUBIC)
-                new_frame = ImageTk.PhotoImage(new_frame)
-                
-                self.master.img_preview.configure(width=new_size[0], height=new_size[1], image=new_frame)
-                self.master.img_preview.image = new_frame #hack to prevent garbage collection
-                
-                self.previous_frame = self.current_frame
-            #
+    #stop the frames thread and wait for it, so the camera is free for something else
+    def stop_preview_thread(self):
+        self.thread_running = False
+        if self.frames_thread and self.frames_thread is not threading.current_thread():
+            self.frames_thread.join()
         #
     #
-    #close camera object
+    #show frame in the main window tkinter label (seperate from image_gui refresh_image()), runs on the tk main loop
+    #the renderer reuses its buffers and image, so nothing new is made per frame unless the window size changes
+    def show_preview_frame(self, frame):
+        self.renderer.show(frame, self.master.get_size())
+    #
+    #close camera object, call from the main loop
     def close(self):
-        self.thread_running = False
+        self.preview.stop()
+        self.stop_preview_thread()
         self.cam.release()
     #
     #change camera resolution, or force max res if no resolution given
+    #returns the resolution the camera actually chose
     def change_size(self, new_res=None):
         if not new_res:
             new_res = max_res
         self.cam.set(cv2.CAP_PROP_FRAME_WIDTH, new_res[0])
         self.cam.set(cv2.CAP_PROP_FRAME_HEIGHT, new_res[1])
+        return (int(self.cam.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cam.get(cv2.CAP_PROP_FRAME_HEIGHT)))
     #
-    #shut down camera preview threads, then create a thread for capturing max res image
+    #shut down camera preview, then create a thread for capturing max res image
+    #image_gui gets the image on the main loop when it's ready
     def start_capture_thread(self):
-        self.thread_running = False
-        capture_thread = threading.Thread(target=self.capture_still)
-        capture_thread.start()
+        self.shutter_time = time.perf_counter()
+        self.preview.stop()
+        camera_preview.run_in_thread(self.master, self.capture_still, self.master.end_image_capture)
     #
-    #capture a max resolution image, convert cv2 img to PIL, return to image_gui
+    #capture a max resolution image, convert cv2 img to PIL and return (image, seconds since capture was pressed), the image is None if the camera gave none
+    #if the preview already has the full resolution the burst starts from its newest frame, otherwise the resolution is switched
+    #and the burst starts from the first proper frame in the new resolution, instead of waiting a fixed time
     def capture_still(self):
-        self.change_size()
-        time.sleep(1)
-        got_frame, frame = self.cam.read()
-        
-        if got_frame:
-            img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            img = Image.fromarray(img)
+        self.stop_preview_thread()
+        with metrics.stage("capture_still", switched=self.resolution != self.still_res):
+            if self.resolution == self.still_res and self.last_frame is not None:
+                frame = self.last_frame
+            else:
+                self.resolution = self.change_size(self.still_res)
+                frame = self.wait_for_frame(self.still_res)
+            #
+            img = None
+            if frame is not None:
+                frame = self.take_burst(frame)
+                img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                img = Image.fromarray(img)
+            #
         #
-        self.master.end_image_capture(img)
+        return img, time.perf_counter() - self.shutter_time
+    #
+    #take the rest of the burst after its first frame and return the sharpest one
+    def take_burst(self, frame):
+        self.burst.clear()
+        self.burst.add(frame)
+        while len(self.burst) < self.burst.size:
+            frame = self.wait_for_frame(self.still_res)
+            if frame is None:
+                break
+            #
+            self.burst.add(frame)
+        #
+        return self.burst.sharpest()
+    #
+    #read frames until one has the given resolution and isn't blank, cameras send a few old or black frames after a switch
+    #returns None if none came within still_timeout
+    def wait_for_frame(self, size):
+        end = time.perf_counter() + still_timeout
+        while time.perf_counter() < end:
+            got_frame, frame = self.cam.read()
+            if not got_frame:
+                time.sleep(0.01)
+            elif (frame.shape[1], frame.shape[0]) == size and frame[::16, ::16].max() > 32:
+                return frame
+            #
         #
+        return None
     #
 #
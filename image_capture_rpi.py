@@ -1,7 +1,14 @@
-from PIL import Image, ImageTk, ImageOps
+from PIL import Image
 import threading
 import cv2
-from picamera2 import Picamera2
+import numpy as np
+import time
+from picamera2 import Picamera2, Preview, MappedArray
+
+#own scripts
+import camera_preview
+import frame_burst
+import metrics
 
 #resolutions used for camera module v2
 max_res = (1640, 1232)
@@ -10,6 +17,28 @@ preview_res = (640, 480)
 #slow opencv embedded preview, or fast, but seperate picamera2 qt window
 use_embedded_preview = True 
 
+#grayscale preview straight from the Y (brightness) plane of the YUV420 frames, color needs a YUV -> RGB conversion of every frame
+color_preview = False
+
+#copy a stride padded YUV420 frame into the packed layout opencv expects, (height * 3/2, width) with no padding
+#picamera2 gives the frame as (height * 3/2, stride) rows, the U and V planes that follow Y have rows of stride/2,
+#so two chroma rows share one row of the array and cropping the columns isn't enough
+#out is reused if given, returns the packed frame
+def unpad_yuv420(array, size, out=None):
+    width, height = size
+    stride = array.shape[1]
+    if out is None:
+        out = np.empty((height * 3 // 2, width), np.uint8)
+    #
+    out[:height] = array[:height, :width]
+    chroma_rows = height // 4 #rows of the array each chroma plane takes
+    for plane in range(2): #U, then V
+        start = height + plane * chroma_rows
+        chroma = array[start:start + chroma_rows].reshape(height // 2, stride // 2)[:, :width // 2]
+        out[start:start + chroma_rows] = chroma.reshape(chroma_rows, width)
+    #
+    return out
+#
 #this script is used just for raspberry pi cameras
 #could also maybe use "sudo modprobe bcm2835-v4l2"
 #to enable raspberry pi camera as a generic usb camera, to use the other script
@@ -21,16 +50,21 @@ class Webcam():
         #variables
         self.cam = None
         self.thread_running = False
-        self.current_frame = None
-        self.previous_frame = None
+        self.frames_thread = None
+        self.shutter_time = None
+        self.preview = camera_preview.Preview_loop(master, self.show_preview_frame, drop=self.release_request)
+        self.burst = frame_burst.Burst()
+        self.renderer = camera_preview.Frame_renderer(master.img_preview, cv2.COLOR_YUV420p2RGBA if color_preview else cv2.COLOR_GRAY2RGBA)
+        self.yuv_frame = None #unpadded copy of the color preview frame, reused for every frame
         
         #initialize picamera2
         self.cam = Picamera2()
         
         #configure preview and capture resolutions
+        #both streams are YUV420, its Y plane is a grayscale image as is, so neither the preview nor the still needs a color conversion
         self.config = self.cam.create_preview_configuration(
-        main={"size": max_res}, 
-        lores={"size": preview_res},
+        main={"size": max_res, "format": "YUV420"}, 
+        lores={"size": preview_res, "format": "YUV420"},
         display="lores")
         
         #set camera configuration
@@ -41,69 +75,101 @@ class Webcam():
             self.cam.start()
         #
     #
-    #create seperate threads for getting camera frames and processing them
+    #start a thread for getting camera frames, they are shown by the tk main loop (see camera_preview)
+    #call from the main loop
     def start_preview_thread(self):
         if use_embedded_preview:
             self.thread_running = True
-            
-            get_frames_thread = threading.Thread(target=self.get_preview_frame)
-            get_frames_thread.start()
-            
-            show_frames_thread = threading.Thread(target=self.show_preview_frame)
-            show_frames_thread.start()
+            self.frames_thread = threading.Thread(target=self.get_preview_frame, daemon=True)
+            self.frames_thread.start()
+            self.preview.start()
         else:
             self.cam.start_preview(Preview.QTGL)
             self.cam.start()
         #
     #
-    #get new frame from cv2 camera
+    #get new frames from the camera
     #*way slower than the picamera2 library qt previews, but those can't be embedded
+    #the frames are passed on as camera requests, so they're shown straight from the camera's buffers without copying them
+    #every request has to be released to give its buffers back, after it's shown or when the slot drops it
+    #capture_request waits for the next frame, so this doesn't spin
     def get_preview_frame(self):
         while self.thread_running:
-            frame = self.cam.capture_array("lores")
-            self.current_frame = frame
+            self.preview.slot.put(self.cam.capture_request())
         #
     #
-    #process frame: convert cv2 frame to PIL and resize it to fit application window 
-    #then update main window tkinter label (seperate from image_gui refresh_image())
-    def show_preview_frame(self):
-        while self.thread_running:
-            temp_frame = self.current_frame
-            if temp_frame is not None and temp_frame is not self.previous_frame:
-                
-                new_size = self.master.get_size()
-                
-                new_frame = cv2.cvtColor(self.current_frame, cv2.COLOR_YUV420p2RGB)
-                new_frame = Image.fromarray(new_frame)
-                new_frame = ImageOps.contain(new_frame, new_size, method=Image.Resampling.BICUBIC)
-                new_frame = ImageTk.PhotoImage(new_frame)
-                
-                self.master.img_preview.configure(width=new_size[0], height=new_size[1], image=new_frame)
-                self.master.img_preview.image = new_frame #hack to prevent garbage collection
-                
-                self.previous_frame = self.current_frame
+    def release_request(self, request):
+        request.release()
+    #
+    #release the requests that were never shown, the camera stops once it runs out of buffers
+    def release_frames(self):
+        request = self.preview.slot.get()
+        while request is not None:
+            request.release()
+            request = self.preview.slot.get()
+        #
+    #
+    #stop the frames thread and wait for it, so the camera is free for something else
+    def stop_preview_thread(self):
+        self.thread_running = False
+        if self.frames_thread and self.frames_thread is not threading.current_thread():
+            self.frames_thread.join()
+        #
+    #
+    #show frame in the main window tkinter label (seperate from image_gui refresh_image()), runs on the tk main loop
+    #the renderer reuses its buffers and image, so nothing new is made per frame unless the window size changes
+    def show_preview_frame(self, request):
+        try:
+            with MappedArray(request, "lores") as mapped:
+                #rows are padded to the stride, the first rows are the Y plane
+                if color_preview:
+                    self.yuv_frame = unpad_yuv420(mapped.array, preview_res, self.yuv_frame)
+                    frame = self.yuv_frame
+                else:
+                    frame = mapped.array[:preview_res[1], :preview_res[0]]
+                #
+                self.renderer.show(frame, self.master.get_size())
             #
+        finally:
+            request.release()
         #
     #
-    #close camera object
+    #close camera object, call from the main loop
     def close(self):
-        self.thread_running = False
+        self.preview.stop()
+        self.stop_preview_thread()
+        self.release_frames()
         self.cam.close()
     #
-    #shut down camera preview threads, then create a thread for capturing max res image
+    #shut down camera preview, then create a thread for capturing max res image
+    #image_gui gets the image on the main loop when it's ready
     def start_capture_thread(self):
-        self.thread_running = False
-        capture_thread = threading.Thread(target=self.capture_still)
-        capture_thread.start()
+        self.shutter_time = time.perf_counter()
+        self.preview.stop()
+        camera_preview.run_in_thread(self.master, self.capture_still, self.master.end_image_capture)
     #
-    #capture a max resolution image, convert cv2 img to PIL, return to image_gui
+    #capture a max resolution image and return (grayscale PIL image, seconds since capture was pressed)
+    #the main stream already runs at max_res next to the preview stream, so this only waits for its next frames
+    #a burst of frames is taken and the sharpest one is used
+    #text detection works on grayscale anyway, so the Y plane goes to it as is, without a round trip through RGB
     def capture_still(self):
-        frame = self.cam.capture_array("main")
-        
-        img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        img = Image.fromarray(img)
-        
-        self.master.end_image_capture(img)
+        self.stop_preview_thread()
+        self.release_frames()
+        with metrics.stage("capture_still", switched=False):
+            self.burst.clear()
+            while len(self.burst) < self.burst.size:
+                request = self.cam.capture_request()
+                try:
+                    with MappedArray(request, "main") as mapped:
+                        self.burst.add(mapped.array[:max_res[1], :max_res[0]]) #copied into the burst, the request can go back right away
+                    #
+                finally:
+                    request.release()
+                #
+            #
+            #own copy, the burst buffer is reused and fromarray would share its memory
+            img = Image.fromarray(self.burst.sharpest().copy())
         #
+        return img, time.perf_counter() - self.shutter_time
     #
 #
@@ -1,15 +1,19 @@
 import tkinter as tk
 from tkinter import ttk
-from tkinter import filedialog as fd, messagebox as mb
+from tkinter import filedialog as fd
+import tkinter.font as tkfont
 import threading
+import queue
+import time
 from PIL import Image, ImageTk, ImageOps
 
 #own scripts
 import db_helper as db
-import text_recognition as tr
+import camera_preview
+import job_queue
 
 #platform/os checks
-import platform, io, subprocess
+import platform, io, os, subprocess
 
 #check if a raspberry pi camera is connected
 def raspberrypi_cam():
@@ -44,6 +48,8 @@ db_window_size = [500, 400]
 icon_path = "icon.png"
 
 class Main_window(tk.Tk):
+    poll_interval = 100 #ms between checks for changed text detection jobs
+
     def __init__(self):
         super().__init__()
         
@@ -58,6 +64,11 @@ class Main_window(tk.Tk):
         self.win_size = main_window_size
         self.after_id = None
         self.camera = None
+        self.image_name = None #shown in the job list when the image is queued
+        
+        #text detection runs in a pool of worker threads, any number of images can be queued
+        self.jobs = job_queue.Job_queue()
+        self.jobs_win = None
         
         #bind window resize event
         self.bind("<Configure>", self.change_win_size)
@@ -73,6 +84,9 @@ class Main_window(tk.Tk):
         #force update so values get initialized, show placeholder logo in window
         self.update()
         self.refresh_img(Image.open(icon_path))
+        
+        #follow the jobs from the main loop
+        self.jobs_id = self.after(self.poll_interval, self.poll_jobs)
     #
     #create bottom bar, buttons and info text
     def bottom_bar(self):
@@ -86,12 +100,19 @@ class Main_window(tk.Tk):
         self.file_b = tk.Button(self.bot_bar, text=" Choose image ", command=self.open_file, height=b_height)
         self.file_b.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=b_padding, pady=b_padding)
         
-        self.detect_b = tk.Button(self.bot_bar, text=" Detect text ", state=tk.DISABLED, command=self.detect_text_thread, height=b_height)
+        self.detect_b = tk.Button(self.bot_bar, text=" Detect text ", state=tk.DISABLED, command=self.detect_text, height=b_height)
         self.detect_b.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=b_padding, pady=b_padding)
         
+        self.jobs_b = tk.Button(self.bot_bar, text=" Results ", command=self.open_jobs, height=b_height)
+        self.jobs_b.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=b_padding, pady=b_padding)
+        
         self.database_b = tk.Button(self.bot_bar, text=" View database ", command=self.new_window, height=b_height)
         self.database_b.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=b_padding, pady=b_padding)
         
+        #progress of the queued text detections
+        self.progress_bar = ttk.Progressbar(self.bot_bar, length=80, maximum=1)
+        self.progress_bar.pack(side=tk.LEFT, padx=b_padding, pady=b_padding)
+        
         self.info_t = tk.Label(self.bot_bar, textvariable=self.info_message)
         self.info_t.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=b_padding, pady=b_padding)
     #
@@ -104,44 +125,60 @@ class Main_window(tk.Tk):
         else:
             self.info_message.set("No database found")
     #
-    #create thread for text detection
-    def detect_text_thread(self):
-        if self.full_image:
-            detect_text_thread = threading.Thread(target=self.detect_text)
-            detect_text_thread.start()
+    #open the job list, if it's already open, focus it
+    def open_jobs(self):
+        if self.jobs_win:
+            self.jobs_win.focus_force()
+        else:
+            self.jobs_win = Jobs_window(self)
         #
     #
-    #run through text detection on image, and display textbox with relults
-    #ask if user wants to save to database
+    #queue the shown image for text detection, the results are reviewed and saved in the job list
     def detect_text(self):
-        self.info_message.set("Detecting text...")
-        self.detect_b.config(state=tk.DISABLED)
-        
-        result = tr.detect_text_from_img(self.full_image)
-        
-        msg_string = f"Date & Time: {result['date_time']}\nTotal Amount: {result['price']} €\nVAT: {result['vat']} %\nSave to database?"
-        
-        msg_box = mb.askyesno("Detected text", msg_string)
-        
-        if msg_box: #Yes
-            success = db.add_row(result)
-            if success:
-                self.info_message.set("Data saved")
-            else:
-                self.info_message.set("Invalid data")
+        if self.full_image:
+            self.jobs.add(self.image_name, self.full_image)
+            self.detect_b.config(state=tk.DISABLED)
+            self.info_message.set("Queued " + self.image_name)
+        #
+    #
+    #take changed jobs from the workers, runs on the tk main loop
+    #the next check is scheduled first, so an error while showing the jobs doesn't stop the checks
+    def poll_jobs(self):
+        self.jobs_id = self.after(self.poll_interval, self.poll_jobs)
+        changed = []
+        while True:
+            try:
+                changed.append(self.jobs.updates.get_nowait())
+            except queue.Empty:
+                break
             #
-        else: #No
-            self.info_message.set("")
-        #    
-        self.detect_b.config(state=tk.NORMAL)
+        #
+        if changed:
+            finished, total = self.jobs.progress()
+            self.progress_bar.configure(maximum=max(1, total), value=finished)
+            
+            counts = self.jobs.counts()
+            waiting = counts.get("queued", 0) + counts.get("running", 0)
+            review = len(self.jobs.jobs) - waiting
+            self.jobs_b.configure(text=f" Results ({review}) " if review else " Results ")
+            if self.jobs_win:
+                self.jobs_win.update_jobs(changed)
+            #
+        #
+    #
+    #show the image of a job from the job list
+    def show_job(self, job):
+        if self.camera or job.image is None:
+            return
+        #
+        self.refresh_img(Image.open(job.image) if isinstance(job.image, str) else job.image)
+        self.image_name = job.name
+        self.detect_b.config(state=tk.DISABLED) #already queued once
     #
     #change and/or resize the current image (seperate from cam preview)
     def refresh_img(self, new_img=None):
         new_size = self.get_size()
         
-        if self.camera and not raspberrypi_cam:
-            self.camera.change_size(new_size)
-        #    
         if new_img:
             self.full_image = new_img
         else:
@@ -154,28 +191,41 @@ class Main_window(tk.Tk):
         self.img_preview.image = new_img #hack to prevent garbage collection
         #
     #
-    #dialogue for importing an already existing image
+    #dialogue for importing already existing images
+    #one image is shown for detecting its text, several are queued for text detection right away
     def open_file(self):
         if self.camera:
             self.close_cam()
-        filepath = fd.askopenfilename(filetypes=[("Images", ".jpg .png")])
-        if filepath:
+        filepaths = fd.askopenfilenames(filetypes=[("Images", ".jpg .jpeg .png")])
+        if filepaths:
             self.img_preview.pack()
-            self.refresh_img(Image.open(filepath))
-            self.detect_b.config(state=tk.NORMAL)
+            self.refresh_img(Image.open(filepaths[0]))
+            self.image_name = os.path.basename(filepaths[0])
+            if len(filepaths) == 1:
+                self.detect_b.config(state=tk.NORMAL)
+            else:
+                for filepath in filepaths:
+                    self.jobs.add(os.path.basename(filepath), filepath)
+                #
+                self.detect_b.config(state=tk.DISABLED)
+                self.info_message.set(f"Queued {len(filepaths)} images")
+            #
         #
     #
-    #create a thread for camera preview
+    #open the camera in a thread because it can take a while, the preview starts on the main loop once it's open
     def start_preview_thread(self):
-        cam_preview_thread = threading.Thread(target=self.start_preview)
-        cam_preview_thread.start()
+        self.detect_b.config(state=tk.DISABLED)
+        self.capture_b.config(state=tk.DISABLED)
+        self.info_message.set("Opening camera...")
+        size = self.get_size()
+        camera_preview.run_in_thread(self, lambda: ic.Webcam(self, size), self.start_preview)
     #
     #start camera preview and change button functions
-    def start_preview(self):
-        self.detect_b.config(state=tk.DISABLED)
-        self.camera = ic.Webcam(self, self.get_size())
+    def start_preview(self, camera):
+        self.capture_b.config(state=tk.NORMAL)
+        self.camera = camera
         
-        if self.camera.cam:
+        if self.camera and self.camera.cam:
             self.info_message.set("")
             self.capture_b.configure(text=" Capture image ", command=self.start_image_capture)
             self.camera.start_preview_thread()
@@ -191,15 +241,27 @@ class Main_window(tk.Tk):
         self.capture_b.configure(text=" Open camera ", command=self.start_preview_thread)
     #
     #create image capture thread for full resolution imagew
+    #the buttons that would capture again or close the camera are disabled until the capture has finished
     def start_image_capture(self):
         self.info_message.set("Capturing image...")
+        self.capture_b.config(state=tk.DISABLED)
+        self.file_b.config(state=tk.DISABLED)
         self.camera.start_capture_thread()
     #
-    #called from image_capture object, after full res image capture has succeeded
-    def end_image_capture(self, new_img):
+    #called on the main loop by the image_capture object when the full res image capture has finished
+    #result is (image, seconds), or None if capturing raised an error
+    def end_image_capture(self, result):
+        new_img, latency = result or (None, None)
         self.close_cam()
-        self.info_message.set("")
+        self.capture_b.config(state=tk.NORMAL)
+        self.file_b.config(state=tk.NORMAL)
+        if new_img is None:
+            self.info_message.set("Image capture failed")
+            return
+        #
+        self.info_message.set(f"Captured {new_img.width}x{new_img.height} in {latency:.2f} s")
         self.refresh_img(new_img)
+        self.image_name = "Camera " + time.strftime("%H:%M:%S")
         self.detect_b.config(state=tk.NORMAL)
     #
     #detect window resize event, schedule resize event if showing preview or image
@@ -209,7 +271,8 @@ class Main_window(tk.Tk):
             if self.win_size[0] != event.width or self.win_size[1] != event.height:
                 self.win_size = [event.width, event.height]
                 
-                if self.full_image or self.camera:
+                #the camera preview fits every frame to the window on its own
+                if self.full_image and not self.camera:
                     self.schedule_resize()
                 #
             #
@@ -227,13 +290,189 @@ class Main_window(tk.Tk):
         return (self.win_size[0] - 4, (self.win_size[1] - self.bot_bar.winfo_height() - 4))
     #
     #close main window event to kill camera preview, otherwise keeps running because it's in a seperate thread
+    #queued text detections are cancelled, running ones finish before the program exits
     def on_close(self):
         self.close_cam()
+        self.after_cancel(self.jobs_id)
+        self.jobs.close()
+        db.close()
         self.destroy()
     #
 #
 
+#queued, running and finished text detections, results are checked here and saved into the database a batch at a time
+#the list only shows the jobs, the work is done by the job queue's workers, so saving or discarding never waits for detection
+class Jobs_window(tk.Toplevel):
+    def __init__(self, master):
+        super().__init__(master)
+        
+        #title and default window size
+        self.title("Results")
+        self.minsize(db_window_size[0], db_window_size[1])
+        
+        #variables
+        self.info_text = tk.StringVar()
+        self.details_text = tk.StringVar()
+        
+        #bind window close event
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        
+        #buttons
+        self.top_bar = tk.Frame(self)
+        self.top_bar.pack(side=tk.TOP, fill=tk.X)
+        tk.Button(self.top_bar, text="Save", command=lambda: self.save(self.selected())).pack(side=tk.LEFT, padx=6, pady=6)
+        tk.Button(self.top_bar, text="Save all", command=lambda: self.save(list(self.master.jobs.jobs.values()))).pack(side=tk.LEFT, padx=0, pady=6)
+        tk.Button(self.top_bar, text="Discard", command=self.discard).pack(side=tk.LEFT, padx=6, pady=6)
+        tk.Button(self.top_bar, text="Cancel", command=self.cancel).pack(side=tk.LEFT, padx=0, pady=6)
+        tk.Label(self.top_bar, textvariable=self.info_text).pack(side=tk.RIGHT, padx=6, pady=6)
+        
+        #details of the selected job
+        self.details_t = tk.Label(self, textvariable=self.details_text, justify=tk.LEFT, anchor=tk.W)
+        self.details_t.pack(side=tk.BOTTOM, fill=tk.X, padx=6, pady=6)
+        
+        #spreadsheet view, one row per job, the row id is the job number
+        self.main_frame = tk.Frame(self)
+        self.main_frame.pack(fill=tk.BOTH, expand=True)
+        self.tree = ttk.Treeview(self.main_frame, columns=("name", "state", "date_time", "price", "vat", "seconds"), show="headings")
+        self.scrollbar = ttk.Scrollbar(self.main_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.configure(yscroll=self.scrollbar.set)
+        self.tree.pack(fill=tk.BOTH, expand=True)
+        
+        for column, text, width, anchor in (("name", "Image", 120, tk.W), ("state", "State", 80, tk.W), ("date_time", "Date & Time", 120, tk.E),
+            ("price", "Price (€)", 70, tk.E), ("vat", "VAT (%)", 50, tk.E), ("seconds", "Time (s)", 50, tk.E)):
+            self.tree.heading(column, text=text)
+            self.tree.column(column, width=width, anchor=anchor)
+        #
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        self.bind("<Control-a>", lambda event: self.tree.selection_set(self.tree.get_children()))
+        
+        self.update_jobs(list(self.master.jobs.jobs.values()))
+    #
+    #add or refresh the rows of changed jobs, rows of removed jobs are deleted
+    def update_jobs(self, jobs):
+        for job in jobs:
+            item = str(job.number)
+            if job.number not in self.master.jobs.jobs:
+                if self.tree.exists(item):
+                    self.tree.delete(item)
+                #
+                continue
+            #
+            values = (job.name, job.state, "", "", "", "" if job.seconds is None else "%0.1f" %(job.seconds))
+            if job.result:
+                #the parser gives the price as text with 2 decimals, shown as it is
+                price = "" if job.result["price"] is None else job.result["price"]
+                vat = "" if job.result["vat"] is None else job.result["vat"]
+                values = values[:2] + (job.result["date_time"] or "", price, vat) + values[5:]
+            #
+            if self.tree.exists(item):
+                self.tree.item(item, values=values)
+            else:
+                self.tree.insert("", tk.END, iid=item, values=values)
+            #
+        #
+        self.refresh_info()
+        self.on_select()
+    #
+    def refresh_info(self):
+        counts = self.master.jobs.counts()
+        self.info_text.set(", ".join(f"{count} {state}" for state, count in counts.items()))
+    #
+    #selected jobs that haven't been removed
+    def selected(self):
+        jobs = self.master.jobs.jobs
+        return [jobs[int(item)] for item in self.tree.selection() if int(item) in jobs]
+    #
+    #show the details of the selected job, and its image in the main window
+    def on_select(self, event=None):
+        jobs = self.selected()
+        if len(jobs) != 1:
+            self.details_text.set(f"{len(jobs)} selected" if jobs else "")
+            return
+        #
+        job = jobs[0]
+        if job.result:
+            self.details_text.set(result_text(job.result))
+        else:
+            self.details_text.set(job.error or job.state.capitalize())
+        #
+        if event:
+            self.master.show_job(job)
+        #
+    #
+    #save the results of finished jobs into the database in one go, in a thread so the window doesn't wait for the database
+    #saved jobs are removed from the list, the ones the database refuses stay with the reason
+    def save(self, jobs):
+        jobs = [job for job in jobs if job.state == "done"]
+        if not jobs:
+            return
+        #
+        for job in jobs:
+            job.state = "saving"
+        #
+        self.update_jobs(jobs)
+        results = [job.result for job in jobs]
+        camera_preview.run_in_thread(self.master, lambda: db.add_rows(results), lambda rejected: self.end_save(jobs, rejected))
+    #
+    #rejected is a list of (index, reason), or None if saving failed, runs on the main loop even if the window has been closed
+    def end_save(self, jobs, rejected):
+        if rejected is None:
+            for job in jobs:
+                job.state = "done"
+            #
+            self.master.info_message.set("Database error, nothing saved")
+        else:
+            rejected = dict(rejected)
+            for index, job in enumerate(jobs):
+                if index in rejected:
+                    job.state = "invalid"
+                    job.error = "Invalid data: " + rejected[index]
+                else:
+                    self.master.jobs.remove(job)
+                #
+            #
+            self.master.info_message.set(f"{len(jobs) - len(rejected)} saved" + (f", {len(rejected)} invalid" if rejected else ""))
+        #
+        for job in jobs:
+            self.master.jobs.updates.put(job) #also updates the results button
+        #
+    #
+    #forget the selected jobs without saving, queued and running ones are cancelled
+    def discard(self):
+        for job in self.selected():
+            if job.state != "saving":
+                self.master.jobs.remove(job)
+            #
+        #
+    #
+    def cancel(self):
+        for job in self.selected():
+            self.master.jobs.cancel(job)
+        #
+    #
+    #window close event, the jobs go on without the window
+    def close(self):
+        self.master.jobs_win = None
+        self.destroy()
+    #
+#
+#detected fields as shown in the job list
+def result_text(result):
+    text = f"Date & Time: {result['date_time']}\nTotal Amount: {result['price']} €\nVAT: {result['vat']} %\n"
+    for vat in result.get("vats", []):
+        amount = "-" if vat["amount"] is None else "%0.2f €" %(vat["amount"])
+        text += f"    {vat['rate']:g} %: {amount}\n"
+    #
+    return text.rstrip("\n")
+#
+
 class Database_window(tk.Toplevel):
+    block_size = 200 #rows fetched from the database at once
+    cached_blocks = 10 #blocks kept in memory around the shown rows
+    poll_interval = 30 #ms between checks for fetched rows
+    count_interval = 1.0 #seconds between checks for new rows in the database
+
     def __init__(self, master):
         super().__init__(master)
         
@@ -242,8 +481,24 @@ class Database_window(tk.Toplevel):
         self.minsize(db_window_size[0], db_window_size[1])
         
         #variables
-        self.page_index = 0
-        self.page_text = tk.StringVar()
+        self.info_text = tk.StringVar()
+        self.search_text = tk.StringVar()
+        self.found = None #rows from db.search while searching, shown instead of the blocks
+        self.sort = "id" #column in db.sort_keys
+        self.descending = False
+        self.count = db.count()
+        self.count_time = time.monotonic()
+        self.position = 0 #row number of the first shown row
+        self.items = [] #tree rows, reused for whatever rows are shown
+        self.blocks = {} #block number: (rows, first_key, last_key)
+        self.requested = set() #block numbers being fetched
+        self.generation = 0 #increased when the order changes, so rows fetched for the old order are dropped
+        
+        #rows are fetched in a thread, the tk main loop never waits for the database
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.fetch_thread = threading.Thread(target=self.fetch_blocks, daemon=True)
+        self.fetch_thread.start()
         
         #bind window close event
         self.protocol("WM_DELETE_WINDOW", self.close)
@@ -255,91 +510,389 @@ class Database_window(tk.Toplevel):
         #spreadsheet view
         self.tree_view()
         
-        #bottom controls
+        #bottom info text
         self.bottom_bar()
         
-        #populate spreadsheet
-        self.fill_rows(0)
+        #populate spreadsheet when results arrive
+        self.poll_id = self.after(self.poll_interval, self.poll_results)
     #
     #create spreadsheet view and scrollbar
+    #the tree only has as many rows as fit in the window, scrolling changes what they show
     def tree_view(self):
-        self.tree = ttk.Treeview(self.main_frame, columns=("id", "entry_date_time", "receipt_date_time", "price", "vat"), show="headings")
+        #fixed row height, so the number of visible rows can be calculated
+        self.row_height = tkfont.nametofont("TkDefaultFont").metrics("linespace") + 4
+        ttk.Style(self).configure("Treeview", rowheight=self.row_height)
         
-        self.scrollbar = ttk.Scrollbar(self.main_frame, orient=tk.VERTICAL, command=self.tree.yview)
-        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        #the text column is only shown while searching, see show_found
+        self.tree = ttk.Treeview(self.main_frame, columns=("id", "entry_date_time", "receipt_date_time", "price", "vat", "text"), show="headings", selectmode="none")
+        self.tree.configure(displaycolumns=self.tree["columns"][:-1])
         
-        self.tree.configure(yscroll=self.scrollbar.set)
+        #the scrollbar covers every row in the database, not just the rows in the tree
+        self.scrollbar = ttk.Scrollbar(self.main_frame, orient=tk.VERTICAL, command=self.on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.tree.pack(fill=tk.BOTH, expand=True)
         
-        self.tree.heading("id", text="ID")
+        self.headings = {"id": "ID", "entry_date_time": "Entry Date & Time", "receipt_date_time": "Receipt Date & Time", "price": "Price (€)", "vat": "VAT (%)", "text": "Text"}
+        for column, text in self.headings.items():
+            if column in db.sort_keys:
+                self.tree.heading(column, text=text, command=lambda column=column: self.sort_by(column))
+            else:
+                self.tree.heading(column, text=text)
+            #
+        #
         self.tree.column("id", width=30, anchor=tk.E)
-        
-        self.tree.heading("entry_date_time", text="Entry Date & Time")
         self.tree.column("entry_date_time", width=120, anchor=tk.E)
-        
-        self.tree.heading("receipt_date_time", text="Receipt Date & Time")
         self.tree.column("receipt_date_time", width=120, anchor=tk.E)
-        
-        self.tree.heading("price", text="Price (€)")
         self.tree.column("price", width=80, anchor=tk.E)
-        
-        self.tree.heading("vat", text="VAT (%)")
         self.tree.column("vat", width=40, anchor=tk.E)
+        self.tree.column("text", width=240, anchor=tk.W)
+        self.refresh_headings()
+        
+        #scrolling, "break" stops the tree from scrolling its own rows
+        self.tree.bind("<Configure>", self.resize)
+        self.tree.bind("<MouseWheel>", self.on_wheel)
+        self.tree.bind("<Button-4>", self.on_wheel)
+        self.tree.bind("<Button-5>", self.on_wheel)
+        self.bind("<Up>", lambda event: self.scroll_to(self.position - 1))
+        self.bind("<Down>", lambda event: self.scroll_to(self.position + 1))
+        self.bind("<Prior>", lambda event: self.scroll_to(self.position - len(self.items)))
+        self.bind("<Next>", lambda event: self.scroll_to(self.position + len(self.items)))
+        self.bind("<Home>", lambda event: self.scroll_to(0))
+        self.bind("<End>", lambda event: self.scroll_to(self.length()))
     #
-    #create bottom bar with page buttons and page info
+    #create bottom bar with the search field, info about the shown rows and the summary button
     def bottom_bar(self):
         self.ribbon = tk.Frame(self)
         self.ribbon.pack(side=tk.BOTTOM)
         
-        self.previous_page_b = tk.Button(self.ribbon, text="<", command=lambda: self.fill_rows(-1))
-        self.previous_page_b.pack(side=tk.LEFT, padx=40, pady=6)
+        self.search_e = tk.Entry(self.ribbon, textvariable=self.search_text, width=24)
+        self.search_e.pack(side=tk.LEFT, padx=6, pady=6)
+        self.search_e.bind("<Return>", lambda event: self.start_search())
         
-        self.page_amount = tk.Label(self.ribbon, textvariable=self.page_text)
-        self.page_amount.pack(side=tk.LEFT, padx=0, pady=6)
+        self.search_b = tk.Button(self.ribbon, text="Search", command=self.start_search)
+        self.search_b.pack(side=tk.LEFT, padx=0, pady=6)
         
-        self.next_page_b = tk.Button(self.ribbon, text=">", command=lambda: self.fill_rows(1))
-        self.next_page_b.pack(side=tk.LEFT, padx=40, pady=6)
+        self.clear_b = tk.Button(self.ribbon, text="Clear", command=self.clear_search)
+        self.clear_b.pack(side=tk.LEFT, padx=6, pady=6)
+        
+        self.page_amount = tk.Label(self.ribbon, textvariable=self.info_text)
+        self.page_amount.pack(side=tk.LEFT, padx=34, pady=6)
+        
+        self.summary_b = tk.Button(self.ribbon, text="Summary", command=lambda: Summary_window(self))
+        self.summary_b.pack(side=tk.LEFT, padx=6, pady=6)
     #
-    #populate the spreadsheet view with rows from the database
-    def fill_rows(self, direction):
-        count = db.count()
-        if self.page_index >= 0 and self.page_index <= (count/db.fetch_amount) and count > 0:
-            #clear the view when switching pages
-            for old_row in self.tree.get_children():
-                self.tree.delete(old_row) 
+    #add or remove tree rows to fill the window
+    def resize(self, event=None):
+        header = self.row_height + 4 #heading row, measured below once there are rows
+        if self.items:
+            bbox = self.tree.bbox(self.items[0])
+            if bbox:
+                header = bbox[1]
             #
-            #get next X amount of rows (specified in db_helper)
-            page_max = (self.page_index * db.fetch_amount) + db.fetch_amount
-            if self.page_index + direction >= 0 and page_max <= count or direction < 0 and page_max >= count:
-                if self.page_index > 0:
-                    self.page_index += direction
+        #
+        visible = max(1, (self.tree.winfo_height() - header) // self.row_height)
+        while len(self.items) < visible:
+            self.items.append(self.tree.insert("", tk.END, values=()))
+        #
+        if len(self.items) > visible:
+            self.tree.delete(*self.items[visible:])
+            del self.items[visible:]
+        #
+        self.render()
+    #
+    #show the rows from self.position onwards, fetch the ones that aren't loaded yet
+    def render(self):
+        if self.found is not None:
+            self.show_found()
+            return
+        #
+        self.position = max(0, min(self.position, self.count - len(self.items)))
+        for slot, item in enumerate(self.items):
+            index = self.position + slot
+            values = ()
+            if index < self.count:
+                block = self.blocks.get(index // self.block_size)
+                if block is None:
+                    values = ("...",)
+                    self.request(index // self.block_size)
+                elif index % self.block_size < len(block[0]):
+                    row = block[0][index % self.block_size]
+                    values = (row[0], row[1], row[2], "%0.2f" %(row[3]), row[4])
+                #
+            #
+            self.tree.item(item, values=values)
+        #
+        #load the blocks before and after the shown rows ahead of time, forget the ones far away
+        first_block = self.position // self.block_size
+        last_block = (self.position + len(self.items)) // self.block_size
+        for block in (first_block - 1, last_block + 1):
+            if block >= 0 and block * self.block_size < self.count:
+                self.request(block)
+            #
+        #
+        for block in list(self.blocks):
+            if abs(block - first_block) > self.cached_blocks // 2:
+                del self.blocks[block]
+            #
+        #
+        self.refresh_info()
+    #
+    #ask the fetch thread for a block of rows
+    #next to a loaded block the rows continue from its key, otherwise they're found by position
+    def request(self, block):
+        if block in self.blocks or block in self.requested:
+            return
+        #
+        self.requested.add(block)
+        if self.blocks.get(block - 1, (None,) * 3)[2] is not None:
+            where = ("after", self.blocks[block - 1][2])
+        elif self.blocks.get(block + 1, (None,) * 3)[1] is not None:
+            where = ("before", self.blocks[block + 1][1])
+        else:
+            where = ("at", block * self.block_size)
+        #
+        self.requests.put((self.generation, self.sort, self.descending, block, where))
+    #
+    #fetch thread, runs until close() sends None
+    def fetch_blocks(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            #
+            generation, sort, descending, block, (how, value) = request
+            #skip blocks the user has already scrolled away from
+            if generation != self.generation or how != "search" and abs(block - self.position // self.block_size) > self.cached_blocks // 2:
+                self.results.put((generation, block, None))
+                continue
+            #
+            try:
+                if how == "search":
+                    page = db.search(value)
+                elif how == "after":
+                    page = db.get_page(sort, descending, value, size=self.block_size)
+                elif how == "before":
+                    page = db.get_page(sort, descending, value, backward=True, size=self.block_size)
+                else:
+                    page = db.get_rows_at(sort, descending, value, self.block_size)
+                #
+            except Exception as error:
+                page = error
+            #
+            self.results.put((generation, block, page))
+        #
+    #
+    #take fetched blocks from the fetch thread and show them, runs on the tk main loop
+    def poll_results(self):
+        changed = False
+        while True:
+            try:
+                generation, block, page = self.results.get_nowait()
+            except queue.Empty:
+                break
+            #
+            if generation != self.generation:
+                continue
+            #
+            self.requested.discard(block)
+            if isinstance(page, Exception):
+                self.info_text.set("Database error: " + str(page))
+            elif block == "search":
+                self.found = page
+                self.position = 0
+                changed = True
+            elif page is not None:
+                self.blocks[block] = page
+                changed = True
+            #
+        #
+        #new receipts change the row numbers, load the shown rows again
+        if time.monotonic() - self.count_time > self.count_interval:
+            self.count_time = time.monotonic()
+            count = db.count()
+            if count != self.count:
+                self.count = count
+                #search results stay as they are until the next search
+                if self.found is None and "search" not in self.requested:
+                    self.reset()
+                    changed = True
                 #
-            #  
-            rows = db.get_rows(self.page_index)
-            self.refresh_page_text(count)
-            #insert rows
-            for row in rows:
-                row = (row[0], row[1], row[2], "%0.2f" %(row[3]), row[4])
-                self.tree.insert("", tk.END, values=row)
             #
         #
+        if changed:
+            self.render()
+        #
+        self.poll_id = self.after(self.poll_interval, self.poll_results)
+    #
+    #forget every loaded row
+    def reset(self):
+        self.generation += 1
+        self.blocks.clear()
+        self.requested.clear()
+    #
+    #search the raw texts of the receipts in the fetch thread, the results are shown when they arrive
+    def start_search(self):
+        text = self.search_text.get().strip()
+        if not text:
+            self.clear_search()
+            return
+        #
+        self.reset()
+        self.requested.add("search")
+        self.requests.put((self.generation, None, None, "search", ("search", text)))
+        self.info_text.set("Searching...")
+    #
+    #go back to showing every receipt
+    def clear_search(self):
+        self.search_text.set("")
+        self.found = None
+        self.position = 0
+        self.tree.configure(displaycolumns=self.tree["columns"][:-1])
+        self.reset()
+        self.render()
+    #
+    #show search results, best match first, with the matching part of the text
+    def show_found(self):
+        self.tree.configure(displaycolumns=self.tree["columns"])
+        self.position = max(0, min(self.position, len(self.found) - len(self.items)))
+        for slot, item in enumerate(self.items):
+            values = ()
+            if self.position + slot < len(self.found):
+                row = self.found[self.position + slot]
+                values = (row[0], row[1], row[2], "%0.2f" %(row[3]), row[4], row[5].replace("\n", " "))
+            #
+            self.tree.item(item, values=values)
+        #
+        self.refresh_info()
+    #
+    #number of rows that can be scrolled through
+    def length(self):
+        return self.count if self.found is None else len(self.found)
+    #
+    def scroll_to(self, position):
+        self.position = int(position)
+        self.render()
+    #
+    #scrollbar events: ("moveto", fraction) or ("scroll", amount, "units"/"pages")
+    def on_scrollbar(self, *args):
+        if args[0] == "moveto":
+            self.scroll_to(float(args[1]) * self.length())
+        elif args[0] == "scroll":
+            self.scroll_to(self.position + int(args[1]) * (len(self.items) if args[2] == "pages" else 1))
+        #
+    #
+    #mouse wheel, delta on windows and mac, buttons 4 and 5 on linux
+    def on_wheel(self, event):
+        self.scroll_to(self.position + (-3 if event.num == 4 or event.delta > 0 else 3))
+        return "break"
+    #
+    #sort by a column from the database, clicking the same column again reverses the order
+    #search results are always in order of relevance, so sorting goes back to every receipt
+    def sort_by(self, column):
+        if self.found is not None:
+            self.search_text.set("")
+            self.found = None
+            self.tree.configure(displaycolumns=self.tree["columns"][:-1])
+        #
+        self.descending = not self.descending if column == self.sort else False
+        self.sort = column
+        self.position = 0
+        self.reset()
+        self.refresh_headings()
+        self.render()
     #
-    #refresh bottom bar info text
-    def refresh_page_text(self, count):
-        temp_str = ""
-        page_min = self.page_index * db.fetch_amount
-        if page_min + db.fetch_amount < count:
-            temp_str = str(page_min) + "/" + str(page_min + db.fetch_amount) + " of " + str(count)
+    #show the sort order as an arrow on the sorted column
+    def refresh_headings(self):
+        for column, text in self.headings.items():
+            if column == self.sort:
+                text += " ▼" if self.descending else " ▲"
+            #
+            self.tree.heading(column, text=text)
+        #
+    #
+    #refresh bottom bar info text and scrollbar
+    def refresh_info(self):
+        length = self.length()
+        shown = min(self.position + len(self.items), length)
+        self.info_text.set(str(self.position) + "/" + str(shown) + " of " + str(length) + (" found" if self.found is not None else ""))
+        if length:
+            self.scrollbar.set(self.position / length, shown / length)
         else:
-            temp_str = str(page_min) + "/" + str(count) + " of " + str(count)
-        self.page_text.set(temp_str)
+            self.scrollbar.set(0, 1)
+        #
     #
     #window close event, change button behaviour from focus to opening the window again
     def close(self):
+        self.after_cancel(self.poll_id)
+        self.requests.put(None)
         self.master.database_b.configure(command=self.master.new_window)
         self.destroy()
     #
 #
+#spending per day or month and vat per rate, read from the summary tables kept by db_helper
+class Summary_window(tk.Toplevel):
+    #shown name: (first column heading, function returning the rows)
+    reports = {
+        "Month": ("Month", lambda: db.get_spending("month")),
+        "Day": ("Day", lambda: db.get_spending("day")),
+        "VAT rate": ("VAT (%)", db.get_vat_breakdown),
+    }
+
+    def __init__(self, master):
+        super().__init__(master)
+        
+        #title and default window size
+        self.title("Summary")
+        self.minsize(db_window_size[0], db_window_size[1])
+        
+        #variables
+        self.report = tk.StringVar(value="Month")
+        self.totals_text = tk.StringVar()
+        
+        #report choice
+        self.top_bar = tk.Frame(self)
+        self.top_bar.pack(side=tk.TOP, fill=tk.X)
+        for name in self.reports:
+            tk.Radiobutton(self.top_bar, text=name, value=name, variable=self.report, command=self.fill_rows).pack(side=tk.LEFT, padx=6, pady=6)
+        #
+        tk.Button(self.top_bar, text="Refresh", command=self.fill_rows).pack(side=tk.RIGHT, padx=6, pady=6)
+        
+        #totals
+        self.totals_t = tk.Label(self, textvariable=self.totals_text)
+        self.totals_t.pack(side=tk.BOTTOM, pady=6)
+        
+        #spreadsheet view
+        self.main_frame = tk.Frame(self)
+        self.main_frame.pack(fill=tk.BOTH, expand=True)
+        self.tree = ttk.Treeview(self.main_frame, columns=("key", "receipts", "total", "vat"), show="headings")
+        self.scrollbar = ttk.Scrollbar(self.main_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.configure(yscroll=self.scrollbar.set)
+        self.tree.pack(fill=tk.BOTH, expand=True)
+        
+        self.tree.heading("receipts", text="Receipts")
+        self.tree.column("receipts", width=60, anchor=tk.E)
+        self.tree.heading("total", text="Total (€)")
+        self.tree.column("total", width=80, anchor=tk.E)
+        self.tree.heading("vat", text="VAT (€)")
+        self.tree.column("vat", width=80, anchor=tk.E)
+        
+        self.fill_rows()
+    #
+    #show the chosen report, the summaries are small so this is fast even for years of receipts
+    def fill_rows(self):
+        heading, get_rows = self.reports[self.report.get()]
+        self.tree.heading("key", text=heading)
+        self.tree.column("key", width=80, anchor=tk.E)
+        
+        self.tree.delete(*self.tree.get_children())
+        for key, receipts, total, vat in get_rows():
+            self.tree.insert("", tk.END, values=(key, receipts, "%0.2f" %(total), "%0.2f" %(vat)))
+        #
+        receipts, total, vat = db.get_totals()
+        self.totals_text.set(f"{receipts} receipts, total {total:0.2f} €, of which VAT {vat:0.2f} € (estimated from each receipt's VAT rate)")
+    #
+#
 #run main GUI
 def app_main(): 
     app = Main_window()
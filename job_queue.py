@@ -0,0 +1,147 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+#own scripts
+import text_recognition as tr
+
+#text detection jobs for the GUI, any number of images can wait for detection while the user keeps loading or capturing more
+#a pool of worker threads runs the jobs, tesseract releases the GIL (or runs as a subprocess) so they run in parallel
+#workers never call tkinter, every job that changes is put into Job_queue.updates and the tk main loop takes it from there
+
+job_workers = min(2, os.cpu_count() or 1) #images detected at the same time, tesseract uses a few threads of its own per image
+
+#one image waiting for, going through or done with text detection
+#states: queued -> running -> done or failed, queued and running jobs can be cancelled
+class Job():
+    def __init__(self, number, name, image):
+        self.number = number
+        self.name = name
+        self.image = image #PIL image, or the path of an image file, which is opened by the worker
+        self.state = "queued"
+        self.result = None #detect_text_from_img result when done
+        self.error = None #error text when failed
+        self.info = {} #details about the run, see detect_text_from_img
+        self.seconds = None
+        self.future = None
+    #
+    def finished(self):
+        return self.state not in ("queued", "running")
+    #
+#
+class Job_queue():
+    def __init__(self, workers=None):
+        self.pool = ThreadPoolExecutor(workers or job_workers, thread_name_prefix="detect")
+        self.lock = threading.Lock() #guards job states, workers and the main loop both change them
+        self.jobs = {} #number: job, every job that hasn't been removed, in the order they were added
+        self.added = 0
+        self.updates = queue.Queue() #jobs whose state changed
+
+        #progress of the current batch, jobs added since every earlier job had finished
+        self.batch_total = 0
+        self.batch_finished = 0
+    #
+    #queue an image for text detection, name is shown in the job list
+    def add(self, name, image):
+        with self.lock:
+            if self.batch_finished == self.batch_total:
+                self.batch_total = self.batch_finished = 0
+            #
+            self.added += 1
+            job = Job(self.added, name, image)
+            self.jobs[job.number] = job
+            self.batch_total += 1
+        #
+        job.future = self.pool.submit(self.run, job)
+        self.updates.put(job)
+        return job
+    #
+    #worker thread
+    def run(self, job):
+        with self.lock:
+            if job.state != "queued": #cancelled just before it started
+                return
+            #
+            job.state = "running"
+        #
+        self.updates.put(job)
+
+        start = time.perf_counter()
+        result, error = None, None
+        try:
+            if isinstance(job.image, str):
+                with Image.open(job.image) as img:
+                    result = tr.detect_text_from_img(img, info=job.info)
+                #
+            else:
+                result = tr.detect_text_from_img(job.image, info=job.info)
+            #
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        #
+        with self.lock:
+            job.seconds = time.perf_counter() - start
+            #a job cancelled while running has already been counted, its result is dropped
+            if job.state == "running":
+                job.result, job.error = result, error
+                job.state = "failed" if error else "done"
+                self.batch_finished += 1
+            #
+        #
+        self.updates.put(job)
+    #
+    #cancel a queued or running job, returns False if it had already finished
+    #tesseract can't be stopped halfway, so a running job keeps its worker until the image is done, but the result is dropped
+    def cancel(self, job):
+        with self.lock:
+            if job.finished():
+                return False
+            #
+            if job.state == "queued" and job.future:
+                job.future.cancel()
+            #
+            job.state = "cancelled"
+            self.batch_finished += 1
+        #
+        self.updates.put(job)
+        return True
+    #
+    #forget a job, queued and running ones are cancelled first
+    def remove(self, job):
+        self.cancel(job)
+        with self.lock:
+            self.jobs.pop(job.number, None)
+        #
+        job.image = None
+        self.updates.put(job)
+    #
+    #(finished, total) jobs of the current batch
+    def progress(self):
+        with self.lock:
+            return self.batch_finished, self.batch_total
+        #
+    #
+    #number of jobs in each state
+    def counts(self):
+        counts = {}
+        with self.lock:
+            for job in self.jobs.values():
+                counts[job.state] = counts.get(job.state, 0) + 1
+            #
+        #
+        return counts
+    #
+    #cancel every job that hasn't started, running jobs are finished before the program exits
+    def close(self):
+        for job in list(self.jobs.values()):
+            if job.state == "queued":
+                self.cancel(job)
+            #
+        #
+        self.pool.shutdown(wait=False, cancel_futures=True)
+    #
+#
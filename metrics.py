@@ -0,0 +1,210 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+import cProfile
+import pstats
+
+#resource only exists on unix-like systems
+try:
+    import resource
+except ImportError:
+    resource = None
+#
+
+#per-stage timing and memory hooks for the recognition pipeline
+#stages report to every added sink, with no sinks (the default) stage() does nothing
+#a sink is any callable that takes one record dict:
+#{"time", "run", "pid", "stage", "seconds", "process_peak_rss", "rss_growth", ("peak_traced", "traced_change"), extra fields given to stage()}
+#process_peak_rss is the high-water mark of the whole process, rss_growth how much the stage raised it
+#with tracemalloc on, peak_traced is the highest traced memory while the stage ran, on top of what there was when it started
+#(allocations of other threads running at the same time count too) and traced_change the memory the stage kept
+
+sinks = []
+local = threading.local()
+
+def add_sink(sink):
+    sinks.append(sink)
+#
+def remove_sink(sink):
+    if sink in sinks:
+        sinks.remove(sink)
+    #
+#
+#start a new run in this thread, every stage after this is tagged with the same run id
+def new_run():
+    local.run = uuid.uuid4().hex[:12]
+    return local.run
+#
+#peak resident memory of the process so far in bytes, None if not available
+def peak_rss():
+    if resource is None:
+        return None
+    #
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 #kilobytes on linux, bytes on mac
+#
+#tracemalloc has a single peak per process, a traced_peak resets it when it starts and when it ends
+#before every reset the old peak is folded into every traced_peak that is still open, nested ones or ones in other threads
+#so each one ends up with the highest traced memory since it started
+#don't call tracemalloc.reset_peak() anywhere else while tracing, use traced_peak instead
+open_peaks = set()
+peak_lock = threading.Lock()
+
+#fold the current peak into every open traced_peak and reset it, call with peak_lock held
+def fold_peak():
+    peak = tracemalloc.get_traced_memory()[1]
+    for tracker in open_peaks:
+        tracker.peak = max(tracker.peak, peak)
+    #
+    tracemalloc.reset_peak()
+#
+#highest traced memory of a block of code: with metrics.traced_peak() as peak: ... then peak.bytes()
+class traced_peak():
+    __slots__ = ("start", "peak", "end")
+
+    def __enter__(self):
+        with peak_lock:
+            fold_peak()
+            self.start = self.peak = tracemalloc.get_traced_memory()[0]
+            open_peaks.add(self)
+        #
+        return self
+    #
+    def __exit__(self, *exc):
+        with peak_lock:
+            fold_peak()
+            open_peaks.discard(self)
+            self.end = tracemalloc.get_traced_memory()[0]
+        #
+        return False
+    #
+    #bytes allocated at the peak on top of what was allocated when the block started
+    def bytes(self):
+        return self.peak - self.start
+    #
+    #bytes still allocated at the end on top of what was allocated when the block started
+    def change(self):
+        return self.end - self.start
+    #
+#
+#send a record to every sink, a broken sink must never break text detection
+def emit(record):
+    for sink in list(sinks):
+        try:
+            sink(record)
+        except Exception:
+            pass
+        #
+    #
+#
+#time a block of code: with metrics.stage("ocr"): ...
+class stage():
+    __slots__ = ("name", "fields", "start", "rss", "traced")
+
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+        self.start = None
+        self.rss = None
+        self.traced = None
+    #
+    def __enter__(self):
+        if sinks:
+            if tracemalloc.is_tracing():
+                self.traced = traced_peak().__enter__()
+            #
+            self.rss = peak_rss()
+            self.start = time.perf_counter()
+        #
+        return self
+    #
+    def __exit__(self, *exc):
+        if self.start is None:
+            return False
+        #
+        seconds = time.perf_counter() - self.start
+        rss = peak_rss()
+        record = {
+            "time": time.time(),
+            "run": getattr(local, "run", None),
+            "pid": os.getpid(),
+            "stage": self.name,
+            "seconds": seconds,
+            "process_peak_rss": rss,
+            "rss_growth": rss - self.rss if rss is not None else None,
+        }
+        if self.traced is not None:
+            self.traced.__exit__()
+            record["peak_traced"] = self.traced.bytes()
+            record["traced_change"] = self.traced.change()
+        #
+        record.update(self.fields)
+        emit(record)
+        return False
+    #
+#
+#sink that appends every record as one line of json
+class Jsonl_sink():
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8")
+    #
+    def __call__(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+        #
+    #
+    def close(self):
+        with self.lock:
+            self.file.close()
+        #
+    #
+#
+#sink that saves records into the metrics table of the receipt database
+#records are written in batches, so timing doesn't turn into one database write per stage
+class Db_sink():
+    def __init__(self, batch_size=100):
+        self.batch_size = batch_size
+        self.records = []
+        self.lock = threading.Lock()
+    #
+    def __call__(self, record):
+        with self.lock:
+            self.records.append(record)
+            if len(self.records) >= self.batch_size:
+                self.flush_locked()
+            #
+        #
+    #
+    def flush(self):
+        with self.lock:
+            self.flush_locked()
+        #
+    #
+    def flush_locked(self):
+        import db_helper #imported here, db_helper itself reports stages through this module
+        if self.records:
+            db_helper.add_metrics(self.records)
+            self.records = []
+        #
+    #
+    def close(self):
+        self.flush()
+    #
+#
+#run func(*args) once under cProfile, save the stats to path (if given) and print the slowest calls
+#returns whatever func returns
+def profile_run(func, *args, path=None, top=20):
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args)
+    if path:
+        profiler.dump_stats(path)
+    #
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
+    return result
+#
@@ -0,0 +1,137 @@
+import sqlite3
+import hashlib
+import json
+import threading
+import time
+
+#local cache for text recognition results, so the same image never goes through OCR twice
+#keyed on a hash of the image pixels + the preprocessing/tesseract settings used
+
+cache_name = "ocr_cache.db"
+max_bytes = 50 * 1024 * 1024 #max total size of cached text and results
+max_age = 90 * 24 * 60 * 60 #seconds since last use before an entry is dropped
+
+class Ocr_cache():
+    def __init__(self, path=cache_name, max_bytes=max_bytes, max_age=max_age):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        #hit/miss counters for this process
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        #one connection shared by every thread, guarded by a lock
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL") #lets batch worker processes read while one writes
+        self.con.execute('''
+        CREATE TABLE IF NOT EXISTS cache(
+        key TEXT PRIMARY KEY,
+        text TEXT NOT NULL,
+        result TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        last_access REAL NOT NULL
+        )''')
+        self.con.execute("CREATE INDEX IF NOT EXISTS cache_last_access ON cache(last_access)")
+        self.con.commit()
+    #
+    #hash the raw image pixels together with the settings that affect the result
+    #works for PIL images and numpy arrays, blake2b is a lot faster than sha256 for big images
+    def make_key(self, img, config):
+        layout = getattr(img, "shape", None) or (img.mode, img.size)
+        h = hashlib.blake2b(digest_size=20)
+        h.update(f"{layout}|{config}|".encode())
+        h.update(img.tobytes())
+        return h.hexdigest()
+    #
+    #return (text, result) for the key, or None if it's not cached
+    def get(self, key):
+        with self.lock:
+            row = self.con.execute("SELECT text, result FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            #
+            self.hits += 1
+            self.con.execute("UPDATE cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.con.commit()
+        #
+        return row[0], json.loads(row[1])
+    #
+    #save the raw ocr text and the parsed result, then evict old entries if needed
+    def put(self, key, text, result):
+        result = json.dumps(result)
+        with self.lock:
+            self.con.execute("INSERT OR REPLACE INTO cache VALUES(?, ?, ?, ?, ?)",
+                (key, text, result, len(text) + len(result), time.time()))
+            self.evict()
+            self.con.commit()
+        #
+    #
+    #drop entries that haven't been used in max_age seconds,
+    #then the least recently used ones until the cache fits into max_bytes
+    def evict(self):
+        cur = self.con.execute("DELETE FROM cache WHERE last_access < ?", (time.time() - self.max_age,))
+        self.evictions += cur.rowcount
+
+        total = self.con.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total > self.max_bytes:
+            #walk from the oldest entry, find the last_access where enough has been freed
+            over = total - self.max_bytes
+            freed = 0
+            cutoff = None
+            for size, last_access in self.con.execute("SELECT size, last_access FROM cache ORDER BY last_access"):
+                freed += size
+                cutoff = last_access
+                if freed >= over:
+                    break
+                #
+            #
+            cur = self.con.execute("DELETE FROM cache WHERE last_access <= ?", (cutoff,))
+            self.evictions += cur.rowcount
+        #
+    #
+    #remove every cached entry
+    def clear(self):
+        with self.lock:
+            self.con.execute("DELETE FROM cache")
+            self.con.commit()
+        #
+    #
+    #hit/miss counters and the current cache size
+    def stats(self):
+        with self.lock:
+            entries, size = self.con.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        #
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
+    #
+    def close(self):
+        with self.lock:
+            self.con.close()
+        #
+    #
+#
+#shared cache used by text_recognition, opened on first use
+cache = None
+cache_lock = threading.Lock()
+
+def get_cache():
+    global cache
+    if cache is None:
+        with cache_lock:
+            if cache is None:
+                cache = Ocr_cache()
+            #
+        #
+    #
+    return cache
+#
@@ -0,0 +1,158 @@
+import threading
+import re #regex
+
+#tesserocr wraps the tesseract C API, so the language models are loaded once and images are passed in memory
+#without it, fall back to pytesseract, which starts a new tesseract process (and writes a temp image) per call
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+#
+import pytesseract
+
+#default tesseract settings used for receipts
+default_lang = "eng+fin"
+default_psm = 6 #assume a single uniform block of text
+default_oem = 3 #default engine, lstm if available
+
+#long-lived tesseract engine, safe to share between threads
+#every thread gets its own tesseract instance (the C API isn't thread safe), created on first use and then reused
+class Ocr_engine():
+    def __init__(self, lang=default_lang, psm=default_psm, oem=default_oem):
+        self.lang = lang
+        self.psm = psm
+        self.oem = oem
+        self.config = f"--psm {psm} --oem {oem}"
+
+        #variables
+        self.local = threading.local()
+        self.apis = [] #every api created by any thread, so close() can free them all
+        self.lock = threading.Lock()
+    #
+    #True if the in-process C API is used, False for the subprocess fallback
+    def in_process(self):
+        return tesserocr is not None
+    #
+    #get this thread's api for the given name, create it if needed
+    def get_api(self, name, **kwargs):
+        api = getattr(self.local, name, None)
+        if api is None:
+            api = tesserocr.PyTessBaseAPI(**kwargs)
+            setattr(self.local, name, api)
+            with self.lock:
+                self.apis.append(api)
+            #
+        #
+        return api
+    #
+    #api for text recognition, loads the language models once per thread
+    def text_api(self):
+        return self.get_api("text_api", lang=self.lang, psm=self.psm, oem=self.oem)
+    #
+    #api for orientation detection, needs the "osd" traineddata
+    def osd_api(self):
+        return self.get_api("osd_api", lang="osd", psm=tesserocr.PSM.OSD_ONLY)
+    #
+    #detect text from a PIL image
+    def image_to_string(self, img):
+        if self.in_process():
+            api = self.text_api()
+            api.SetImage(img)
+            text = api.GetUTF8Text()
+            api.Clear() #free the image, keep the loaded models
+            return text
+        #
+        return pytesseract.image_to_string(img, lang=self.lang, config=self.config)
+    #
+    #detect text from a PIL image, return it as lines with positions and word confidences
+    #every line is a dict: {"text": str, "box": (left, top, right, bottom), "confs": [0-100 per word]}
+    def image_to_lines(self, img):
+        lines = []
+        if self.in_process():
+            api = self.text_api()
+            api.SetImage(img)
+            api.Recognize()
+            
+            level = tesserocr.RIL.WORD
+            for word in tesserocr.iterate_level(api.GetIterator(), level):
+                if word.Empty(level):
+                    continue
+                #
+                if not lines or word.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                    lines.append([])
+                #
+                lines[-1].append((word.GetUTF8Text(level), word.BoundingBox(level), word.Confidence(level)))
+            #
+            api.Clear()
+        else:
+            data = pytesseract.image_to_data(img, lang=self.lang, config=self.config, output_type=pytesseract.Output.DICT)
+            line_ids = {}
+            for i, text in enumerate(data["text"]):
+                #level 5 = word, empty "words" are layout boxes without text
+                if data["level"][i] != 5 or not text.strip():
+                    continue
+                #
+                line_id = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+                if line_id not in line_ids:
+                    line_ids[line_id] = len(lines)
+                    lines.append([])
+                #
+                left, top = data["left"][i], data["top"][i]
+                box = (left, top, left + data["width"][i], top + data["height"][i])
+                lines[line_ids[line_id]].append((text, box, float(data["conf"][i])))
+            #
+        #
+        return [merge_words(words) for words in lines]
+    #
+    #return how many degrees the image has to be rotated clockwise to be upright (0, 90, 180 or 270)
+    #raises an exception if orientation can't be detected, e.g. due to insufficient dpi
+    def detect_rotation(self, img):
+        if self.in_process():
+            api = self.osd_api()
+            api.SetImage(img)
+            osd = api.DetectOrientationScript()
+            api.Clear()
+            if not osd:
+                raise RuntimeError("orientation detection failed")
+            #
+            #orient_deg is the current orientation of the text, rotating by the opposite straightens it
+            return (360 - osd["orient_deg"]) % 360
+        #
+        img_info = pytesseract.image_to_osd(img)
+        return int(re.search(r"(?<=Rotate: )\d+", img_info).group(0))
+    #
+    #free every tesseract instance, the engine creates new ones if it's used again
+    def close(self):
+        with self.lock:
+            for api in self.apis:
+                api.End()
+            #
+            self.apis = []
+            self.local = threading.local()
+        #
+    #
+#
+#combine the words of one line into a line dict
+def merge_words(words):
+    return {
+        "text": " ".join(word[0] for word in words),
+        "box": (min(word[1][0] for word in words), min(word[1][1] for word in words),
+            max(word[1][2] for word in words), max(word[1][3] for word in words)),
+        "confs": [word[2] for word in words],
+    }
+#
+#shared engines used by text_recognition, one per combination of settings, created on first use
+engines = {}
+engine_lock = threading.Lock()
+
+def get_engine(lang=default_lang, psm=default_psm, oem=default_oem):
+    key = (lang, psm, oem)
+    if key not in engines:
+        with engine_lock:
+            if key not in engines:
+                engines[key] = Ocr_engine(lang, psm, oem)
+            #
+        #
+    #
+    return engines[key]
+#
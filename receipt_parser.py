@@ -0,0 +1,166 @@
+import re #regex
+
+#parse date & time, total price and every VAT rate with its amount from raw OCR text
+#the text is lowercased and split into lines once, then every line is checked in a single pass
+
+#dates: d.m.yyyy, d/m/yyyy, d-m-yyyy, d.m.yy, d/m/yy and yyyy-mm-dd
+date_patterns = [
+    (re.compile(r"\b(\d{1,2})[./-](\d{1,2})[./-](\d{4})\b"), ("day", "month", "year")),
+    (re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b"), ("year", "month", "day")),
+    (re.compile(r"\b(\d{1,2})[./](\d{1,2})[./](\d{2})\b"), ("day", "month", "year")),
+]
+#times: h:mm, hh:mm, hh:mm:ss
+time_pattern = re.compile(r"\b(\d{1,2}):(\d{2})(?::(\d{2}))?\b")
+#money amounts have 2 decimals: 12,40 / 12.40 / 1 234,56 (space or no-break space between thousands),
+#but not parts of dates (12.03.2024) or rates (14,00%)
+amount_pattern = re.compile(r"(?<![\d.,])(\d{1,3}(?:[ \u00a0]\d{3})+|\d+)[.,](\d{2})(?![\d%]|[.,]\d)")
+#whole euros on a total line without any amount with decimals: "summa 5", not dates, times or rates
+whole_pattern = re.compile(r"(?<![\d.,:/-])(\d+)(?![\d.,:/-]| ?%)")
+#vat rates: 14%, 14 %, 25,5%, 14,00%, not negative ones like discounts (-20%)
+rate_pattern = re.compile(r"(?<![\d.,-])(\d{1,2}(?:[.,]\d{1,2})?) ?%")
+#vat table rows under a header, where the % may only be in the header: "14,00 1,52 10,88 12,40", "a 24 % 1,94 8,06 10,00"
+table_row_pattern = re.compile(r"(?:[a-z] +)?(\d{1,2}(?:[.,]\d{1,2})?) *%?(?= )")
+
+#lines with totals and vat rates
+price_keywords = re.compile(r"summa|amount|yht|total") #"yht" covers "yhteensä"
+vat_keywords = re.compile(r"\balv|\bvat\b|\bmoms") #word starts, "halvempi" isn't a vat line
+discount_keywords = re.compile(r"alennus|\bale\b|discount|rabatt|bonus") #percentages on these lines aren't vat rates
+
+#convert "," to "." so python recognizes floats
+def to_float(text):
+    return float(text.replace(",", "."))
+#
+#return (day, month, year) of the first valid date in the line, or None
+def find_date(line):
+    for pattern, order in date_patterns:
+        for match in pattern.finditer(line):
+            parts = dict(zip(order, map(int, match.groups())))
+            if parts["year"] < 100:
+                parts["year"] += 2000
+            #
+            if 1 <= parts["day"] <= 31 and 1 <= parts["month"] <= 12:
+                return parts["day"], parts["month"], parts["year"]
+            #
+        #
+    #
+    return None
+#
+#return "hh:mm" or "hh:mm:ss" for the first valid time in the line, or None
+def find_time(line):
+    for match in time_pattern.finditer(line):
+        hours, minutes, seconds = match.groups()
+        if int(hours) < 24 and int(minutes) < 60 and (seconds is None or int(seconds) < 60):
+            time_text = f"{int(hours):02d}:{minutes}"
+            if seconds is not None:
+                time_text += f":{seconds}"
+            #
+            return time_text
+        #
+    #
+    return None
+#
+#money amounts in the line as floats
+def find_amounts(line):
+    return [float(f"{whole.replace(' ', '').replace(chr(0xa0), '')}.{decimals}") for whole, decimals in amount_pattern.findall(line)]
+#
+#pick the vat amount from the amounts that follow a vat rate
+#vat tables usually have tax, net and gross columns in some order, where tax + net = gross
+def pick_vat_amount(amounts):
+    if len(amounts) >= 3:
+        for i, a in enumerate(amounts):
+            for j, b in enumerate(amounts):
+                if i < j and any(abs(a + b - c) < 0.015 for k, c in enumerate(amounts) if k != i and k != j):
+                    return min(a, b)
+                #
+            #
+        #
+    #
+    return min(amounts) if amounts else None
+#
+#parse one receipt, returns {"date_time", "price", "vat", "vats"}
+#date_time is "dd.mm.yyyy hh:mm(:ss)", price and vat (the highest rate) are strings with 2 decimals
+#vats is a list of {"rate": float, "amount": float or None}, one per vat rate, sorted by rate
+def parse(text):
+    date = None
+    time_text = None
+    price = None
+    vats = {} #rate: (number of amounts on the line, amount)
+    vat_table = False #True on the lines after a vat header or vat row, rows there don't need a keyword or a %
+
+    for line in text.lower().splitlines():
+        if not line:
+            continue
+        #
+        #dates need at least two separators next to digits, skip the rest of the lines quickly
+        if date is None and line.count(".") + line.count("/") + line.count("-") >= 2:
+            date = find_date(line)
+        #
+        if time_text is None and ":" in line:
+            time_text = find_time(line)
+        #
+        #totals: the biggest amount on any line with a price keyword
+        if price_keywords.search(line):
+            amounts = find_amounts(line) or [float(whole) for whole in whole_pattern.findall(line)]
+            if amounts and (price is None or max(amounts) > price):
+                price = max(amounts)
+            #
+        #
+        #vat rates, and the vat amount if the line has one
+        #on lines with a vat keyword, and on the rows of a vat table, which continues as long as the lines have a rate
+        vat_line = vat_keywords.search(line) is not None and discount_keywords.search(line) is None
+        if vat_line or vat_table:
+            rates = [(to_float(match.group(1)), match.end()) for match in rate_pattern.finditer(line)]
+            if not rates and not vat_line:
+                #a row without %, the rate is the first number and at least 2 amounts follow it
+                row = table_row_pattern.match(line.strip())
+                if row and len(find_amounts(line.strip()[row.end():])) >= 2:
+                    rates = [(to_float(row.group(1)), row.end())]
+                    line = line.strip()
+                #
+            #
+            for rate, end in rates:
+                if rate > 50:
+                    continue #not a vat rate
+                #
+                amounts = find_amounts(line[end:])
+                #prefer table rows with the most columns, later rows win ties (the vat table is at the bottom)
+                if rate not in vats or len(amounts) >= vats[rate][0]:
+                    vats[rate] = (len(amounts), pick_vat_amount(amounts))
+                #
+            #
+            vat_table = vat_line or bool(rates)
+        #
+    #
+    result = {"date_time": None, "price": None, "vat": None, "vats": []}
+    if date:
+        result["date_time"] = f"{date[0]:02d}.{date[1]:02d}.{date[2]:04d} " + (time_text or "00:00") #add blank time if needed
+    #
+    if price is not None:
+        result["price"] = "{:.2f}".format(price)
+    #
+    if vats:
+        result["vat"] = "{:.2f}".format(max(vats))
+        result["vats"] = [{"rate": rate, "amount": vats[rate][1]} for rate in sorted(vats)]
+    #
+    return result
+#
+#parse many receipts, e.g. texts stored in the database or the ocr cache
+def parse_many(texts):
+    return [parse(text) for text in texts]
+#
+#parse every raw text stored in the ocr cache and report the speed
+#usage: python receipt_parser.py [ocr_cache.db]
+if __name__ == "__main__":
+    import sqlite3, sys, time
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "ocr_cache.db"
+    con = sqlite3.connect(path)
+    texts = [row[0] for row in con.execute("SELECT text FROM cache")]
+    con.close()
+
+    start = time.perf_counter()
+    results = parse_many(texts)
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(results)} texts in {elapsed:.2f}s ({len(results) / max(elapsed, 1e-9):.0f} texts/s)")
+#
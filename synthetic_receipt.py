@@ -0,0 +1,135 @@
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+#render fake finnish/english receipts with known contents, for benchmarks
+#everything is drawn locally, no network or image files needed
+
+stores = ["K-MARKET KESKUSTA", "S-MARKET ASEMA", "LIDL HELSINKI", "RAUTA JA TYÖKALU OY", "CORNER SHOP LTD"]
+addresses = ["Kauppakatu 1, 00100 Helsinki", "Asemantie 12, 33100 Tampere", "Main Street 5", "Teollisuustie 3, 90100 Oulu"]
+#name, price, vat rate
+products = [
+    ("MAITO 1L", 1.29, 14.0), ("RUISLEIPÄ", 2.49, 14.0), ("KAHVI 500G", 5.99, 14.0), ("BANAANI", 1.15, 14.0),
+    ("JUUSTO 400G", 4.79, 14.0), ("JOGURTTI", 0.99, 14.0), ("BREAD", 2.19, 14.0), ("APPLES 1KG", 2.85, 14.0),
+    ("PARISTO AA 4KPL", 4.90, 25.5), ("RUUVIT 100KPL", 6.50, 25.5), ("BATTERIES", 7.95, 25.5), ("KYNÄ", 1.20, 25.5),
+    ("SHAMPOO", 3.45, 25.5), ("TISKIAINE", 2.75, 25.5),
+]
+footers = ["KIITOS KÄYNNISTÄ", "THANK YOU", "TERVETULOA UUDELLEEN"]
+#monospace fonts found on most systems, the pillow default font is used if none exist
+font_names = ["DejaVuSansMono.ttf", "LiberationMono-Regular.ttf", "cour.ttf", "Menlo.ttc"]
+
+#decimal number with a comma, like on finnish receipts
+def money(value):
+    return f"{value:.2f}".replace(".", ",")
+#
+def load_font(size):
+    for name in font_names:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            pass
+        #
+    #
+    return ImageFont.load_default(size=size)
+#
+#random receipt contents and the values the parser should find from them
+def receipt_contents(rng):
+    items = rng.sample(products, rng.randint(3, 9))
+    when = datetime(2023, 1, 1) + timedelta(minutes=rng.randint(0, 700 * 24 * 60))
+
+    lines = [rng.choice(stores), rng.choice(addresses), "", when.strftime("%d.%m.%Y %H:%M"), ""]
+    for name, price, _ in items:
+        lines.append((name, money(price)))
+    #
+    total = round(sum(price for _, price, _ in items), 2)
+    lines += ["", ("YHTEENSÄ EUR", money(total)), ("KORTTI", money(total)), ""]
+
+    #vat table: rate, tax, net, gross
+    lines.append("ALV%     VERO   NETTO  BRUTTO")
+    vats = []
+    for rate in sorted({rate for _, _, rate in items}):
+        gross = round(sum(price for _, price, r in items if r == rate), 2)
+        tax = round(gross * rate / (100 + rate), 2)
+        lines.append(f"{money(rate)}%  {money(tax):>6} {money(gross - tax):>7} {money(gross):>7}")
+        vats.append({"rate": rate, "amount": tax})
+    #
+    lines += ["", rng.choice(footers)]
+
+    truth = {
+        "date_time": when.strftime("%d.%m.%Y %H:%M"),
+        "price": f"{total:.2f}",
+        "vat": f"{max(v['rate'] for v in vats):.2f}",
+        "vats": vats,
+    }
+    return lines, truth
+#
+#draw the receipt lines, black on white, width in pixels sets the resolution
+def draw_receipt(lines, width):
+    chars = 32 #characters per line
+    font = load_font(max(8, int(width / chars * 1.6)))
+    char_w = font.getlength("0")
+    line_h = int(font.size * 1.4)
+    margin = int(width * 0.05)
+
+    img = Image.new("L", (width, line_h * len(lines) + margin * 2), 255)
+    draw = ImageDraw.Draw(img)
+    for index, line in enumerate(lines):
+        y = margin + index * line_h
+        if isinstance(line, tuple): #name on the left, price on the right
+            draw.text((margin, y), line[0], font=font, fill=0)
+            draw.text((width - margin - char_w * len(line[1]), y), line[1], font=font, fill=0)
+        else:
+            draw.text((margin, y), line, font=font, fill=0)
+        #
+    #
+    return img
+#
+#render one receipt, returns (RGB PIL image, truth)
+#skew = small tilt in degrees, rotation = 0/90/180/270, both counter-clockwise
+#noise = standard deviation of gaussian noise as a fraction of 255
+#background = put the receipt on a darker "table" so receipt cropping has something to do
+def render(rng, width=800, skew=0.0, rotation=0, noise=0.0, background=False):
+    lines, truth = receipt_contents(rng)
+    img = draw_receipt(lines, width)
+
+    fill = 255
+    if background:
+        table = Image.new("L", (int(img.width * 1.6), int(img.height * 1.2)), 70)
+        table.paste(img, ((table.width - img.width) // 2, (table.height - img.height) // 2))
+        img, fill = table, 70
+    #
+    angle = skew + rotation
+    if angle:
+        img = img.rotate(angle, resample=Image.Resampling.BICUBIC, expand=True, fillcolor=fill)
+    #
+    if noise:
+        np_rng = np.random.default_rng(rng.randrange(2**32))
+        pixels = np.asarray(img, dtype=np.float32) + np_rng.normal(0, noise * 255, (img.height, img.width))
+        img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    #
+    truth["angle"] = angle
+    return img.convert("RGB"), truth
+#
+#write a folder of receipts and their ground truth, e.g. for batch_app.py
+#usage: python synthetic_receipt.py <folder> [count]
+if __name__ == "__main__":
+    import json, os, sys
+
+    folder = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    os.makedirs(folder, exist_ok=True)
+
+    rng = random.Random(0)
+    truths = {}
+    for i in range(count):
+        img, truth = render(rng, skew=rng.uniform(-5, 5), noise=0.03)
+        name = f"receipt_{i:04d}.png"
+        img.save(os.path.join(folder, name))
+        truths[name] = truth
+    #
+    with open(os.path.join(folder, "truth.json"), "w", encoding="utf-8") as f:
+        json.dump(truths, f, indent=1)
+    #
+#
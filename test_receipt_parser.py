@@ -0,0 +1,58 @@
+import unittest
+
+#own scripts
+import receipt_parser
+
+#parser cases the single-pass parser once got wrong
+#run with: python -m unittest test_receipt_parser (or python -m pytest)
+class Parse_tests(unittest.TestCase):
+    def test_thousands_separator(self):
+        self.assertEqual(receipt_parser.parse("Summa 1 234,56")["price"], "1234.56")
+        self.assertEqual(receipt_parser.parse("Yhteensä 1 234,56 EUR")["price"], "1234.56")
+    #
+    def test_whole_euro_total(self):
+        self.assertEqual(receipt_parser.parse("Summa 5")["price"], "5.00")
+        #dates and times on other lines are not totals
+        self.assertEqual(receipt_parser.parse("12.03.2024 10:15\nSumma 5 €")["price"], "5.00")
+    #
+    def test_amounts_with_decimals_win_over_whole_numbers(self):
+        self.assertEqual(receipt_parser.parse("Yhteensä 3 kpl 12,40")["price"], "12.40")
+    #
+    def test_discount_is_not_vat(self):
+        result = receipt_parser.parse("Maito 2,00\nALENNUS -20%\nYhteensä 1,60")
+        self.assertIsNone(result["vat"])
+        self.assertEqual(result["vats"], [])
+        #a negative rate without a keyword is skipped even on a vat line
+        result = receipt_parser.parse("ALV 14% 0,20 1,40 1,60 -20%")
+        self.assertEqual(result["vat"], "14.00")
+    #
+    def test_percent_without_vat_context(self):
+        self.assertIsNone(receipt_parser.parse("Kampanja 30% halvempi\nSumma 4,00")["vat"])
+    #
+    def test_vat_table_with_header_only_percent(self):
+        text = "ALV% VEROTON VERO VEROLLINEN\n14,00 10,88 1,52 12,40\n24,00 8,06 1,94 10,00\nYHTEENSÄ 22,40\nKORTTI 22,40"
+        result = receipt_parser.parse(text)
+        self.assertEqual(result["vat"], "24.00")
+        self.assertEqual(result["vats"], [{"rate": 14.0, "amount": 1.52}, {"rate": 24.0, "amount": 1.94}])
+        self.assertEqual(result["price"], "22.40")
+    #
+    def test_vat_table_with_percent_on_rows(self):
+        text = "ALV%     VERO   NETTO  BRUTTO\n14,00%    1,52   10,88   12,40\n24,00%    1,94    8,06   10,00"
+        result = receipt_parser.parse(text)
+        self.assertEqual(result["vats"], [{"rate": 14.0, "amount": 1.52}, {"rate": 24.0, "amount": 1.94}])
+    #
+    def test_vat_table_ends_at_first_line_without_rate(self):
+        text = "ALV% VERO NETTO BRUTTO\n24,00 1,94 8,06 10,00\nKiitos käynnistä\n12 kpl 3,00 36,00"
+        self.assertEqual([vat["rate"] for vat in receipt_parser.parse(text)["vats"]], [24.0])
+    #
+    def test_vat_line(self):
+        result = receipt_parser.parse("ALV 24% 1,94 8,06 10,00")
+        self.assertEqual(result["vats"], [{"rate": 24.0, "amount": 1.94}])
+    #
+    def test_date_and_time(self):
+        self.assertEqual(receipt_parser.parse("12.03.2024 10:15\nSumma 5,00")["date_time"], "12.03.2024 10:15")
+    #
+#
+if __name__ == "__main__":
+    unittest.main()
+#
@@ -1,197 +1,583 @@
 from PIL import Image
 
-import pytesseract
 import re #regex
+import tracemalloc
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import cv2
 
-#grayscale -> invert -> threshold -> 2d deskew (basically just rotation)
-#todo: switch to 3d deskew to correct for actual perspective
-def preprocess(pil_img):
+#own scripts
+import ocr_engine
+import ocr_cache
+import receipt_parser
+import metrics
+
+#versions of the preprocessing and parsing steps, part of the result cache key
+preprocess_version = 6
+parse_version = 3
+
+#always run tesseract orientation detection after preprocessing, even if preprocessing found the orientation
+use_osd = False
+#look for the receipt in the image and crop + flatten it before anything else
+crop_receipts = True
+#"full" recognizes the whole receipt
+#"regions" does a quick pass on a smaller image, then properly recognizes only the lines the parser needs
+#(falls back to "full" if some field is still missing)
+#"tiered" goes through ocr_tiers from the cheapest to the most expensive, stopping at the first good enough result
+ocr_mode = "full"
+
+#grayscale -> receipt crop + perspective correction -> invert + threshold -> 2d deskew + orientation
+#works on a single channel uint8 buffer the whole way, modified in place wherever possible
+#accepts a PIL image or a numpy array (cv2 BGR or already grayscale)
+#returns a grayscale PIL image and whether the up/down orientation could be decided
+def preprocess(img):
+    #convert straight to grayscale, no rgb/bgr numpy copies in between
+    with metrics.stage("grayscale"):
+        if isinstance(img, Image.Image):
+            if img.mode != "L":
+                img = img.convert("L")
+            #
+            gray_img = np.array(img) #own writable copy, the PIL image stays untouched
+        elif img.ndim == 3:
+            gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        else:
+            gray_img = img.copy()
+        #
+    #
+    #cut out just the receipt and flatten it, so tesseract doesn't waste time on the table and background
+    if crop_receipts:
+        with metrics.stage("crop"):
+            gray_img = crop_receipt(gray_img)
+        #
+    #
     #resize image if one of the dimensions is less then 1000
-    img_size = pil_img.size
-    if img_size[0] < 1000 or img_size[1] < 1000:
-        pil_img = pil_img.resize((img_size[0]*2, img_size[1]*2))
+    img_h, img_w = gray_img.shape
+    if img_w < 1000 or img_h < 1000:
+        with metrics.stage("resize"):
+            gray_img = cv2.resize(gray_img, (img_w*2, img_h*2), interpolation=cv2.INTER_CUBIC)
+        #
     #
-    #convert PIL image to cv2
-    cv2_img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-
-    #convert image to grayscale and flip black and white
-    gray_img= cv2.cvtColor(cv2_img, cv2.COLOR_BGR2GRAY)
-    gray_img_inverted = cv2.bitwise_not(gray_img)
+    #flip black and white and threshold in one in-place step, OCR prefers white text on black background
+    #every dark pixel becomes white (255), every light pixel black (0)
+    with metrics.stage("threshold"):
+        cv2.threshold(gray_img, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU, dst=gray_img)
+    #
+    #estimate skew and orientation on a small copy, then straighten the full image with a single warp
+    with metrics.stage("deskew"):
+        angle, upright_known = estimate_rotation(gray_img)
+        final_img = rotate_img(gray_img, angle)
+    #
+    
+    #cv2.imwrite("test_prepro.jpg", final_img) #DEBUG
+    
+    #wrap the buffer as a grayscale PIL image for tesseract, shares memory instead of copying
+    return Image.fromarray(final_img), upright_known
+#
+#max size of the longer side of the image used for finding the receipt
+receipt_search_size = 500
+#how much of the image the receipt has to cover to be trusted, and when it covers so much that cropping is pointless
+min_receipt_area = 0.15
+max_receipt_area = 0.9
 
-    #threshold image so every dark pixel is black (0), every light pixel is white (255)
-    threshold_img = cv2.threshold(gray_img_inverted, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+#find the receipt (the biggest 4 cornered shape) on a small copy of the image
+#then warp just that area from the full size image into a flat rectangle
+#returns the image untouched if no receipt is found
+def crop_receipt(gray_img):
+    corners = find_receipt(gray_img)
+    if corners is None:
+        return gray_img
+    #
+    #order the corners: top left, top right, bottom right, bottom left
+    #pull them in a little, the receipt's own edges would otherwise show up as long lines after thresholding
+    corners = inset_corners(order_corners(corners))
+    
+    #output size from the longer of each pair of opposite edges, keeps the resolution of the original capture
+    (tl, tr, br, bl) = corners
+    new_w = int(max(np.linalg.norm(tr - tl), np.linalg.norm(br - bl)))
+    new_h = int(max(np.linalg.norm(bl - tl), np.linalg.norm(br - tr)))
+    
+    target = np.array([[0, 0], [new_w - 1, 0], [new_w - 1, new_h - 1], [0, new_h - 1]], np.float32)
+    matrix = cv2.getPerspectiveTransform(corners, target)
+    return cv2.warpPerspective(gray_img, matrix, (new_w, new_h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+#
+#return the 4 corners of the receipt in full size image coordinates as float32, or None
+def find_receipt(gray_img):
+    small_img, factor = shrink(gray_img, receipt_search_size)
+    small_area = small_img.shape[0] * small_img.shape[1]
+    
+    #receipt edges against the background, blur first so the text itself doesn't count as edges
+    edges = cv2.GaussianBlur(small_img, (5, 5), 0)
+    edges = cv2.Canny(edges, 50, 150)
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+    
+    contours = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        area = cv2.contourArea(contour)
+        if area < small_area * min_receipt_area:
+            break #sorted, the rest are even smaller
+        #
+        if area > small_area * max_receipt_area:
+            return None #receipt fills the whole image already, e.g. a scanned one
+        #
+        #simplify the outline, a receipt should be left with 4 corners
+        perimeter = cv2.arcLength(contour, True)
+        approx = cv2.approxPolyDP(contour, 0.02 * perimeter, True)
+        if len(approx) == 4 and cv2.isContourConvex(approx):
+            return approx.reshape(4, 2).astype(np.float32) * factor
+        #
+    #
+    return None
+#
+#move every corner towards the center by a fraction of the distance
+def inset_corners(corners, amount=0.02):
+    center = corners.mean(axis=0)
+    return (corners + (center - corners) * amount).astype(np.float32)
+#
+#sort 4 corner points into top left, top right, bottom right, bottom left
+def order_corners(corners):
+    sums = corners.sum(axis=1) #x + y: smallest at top left, biggest at bottom right
+    diffs = np.diff(corners, axis=1).ravel() #y - x: smallest at top right, biggest at bottom left
+    return np.array([corners[np.argmin(sums)], corners[np.argmin(diffs)], corners[np.argmax(sums)], corners[np.argmax(diffs)]], np.float32)
+#
+#max size of the longer side of the images used for angle estimation
+coarse_size = 200 #full -90..90 search, 1 degree steps
+fine_size = 800 #refine around the coarse angle, 0.1 degree steps
+#how lopsided text lines have to be before the up/down orientation is trusted
+flip_threshold = 0.02
+#how much more common left aligned lines have to be than right aligned ones (or the other way) to trust the margins
+margin_threshold = 0.1
 
-    #grab coordinates of all non-black pixels, then form a bounding box
-    coordinates = np.column_stack(np.where(threshold_img > 0))
+#find how many degrees (counter-clockwise) a thresholded image has to be rotated to be straight and upright
+#uses projection profiles: when the text lines are horizontal, the row sums are as "spiky" as possible
+#returns (angle, upright_known), upright_known is False if a 180 degree flip couldn't be ruled out
+def estimate_rotation(threshold_img):
+    #small image pyramid, the coarse level is made from the fine one
+    fine_img = downscale(threshold_img, fine_size)
+    coarse_img = downscale(fine_img, coarse_size)
     
-    #minAreaRect returns between -90 and 0
-    angle = cv2.minAreaRect(coordinates)[-1]
+    coarse_points = foreground_points(coarse_img)
+    if coarse_points is None: #blank image, nothing to straighten
+        return 0.0, False
+    #
+    #coarse pass over every line direction, covers both small skew and 90 degree turns
+    angle = best_angle(coarse_points, np.arange(-90, 90, 1.0))
     
-    if angle == 0:
-        #convert cv2 image back to PIL
-        final_img = Image.fromarray(cv2.cvtColor(threshold_img, cv2.COLOR_BGR2RGB))
-    else:
-        #straighten angle
-        if angle < -45:
-            angle = -(90 + angle)
-        else:
-            angle = -angle
-        #
-        #get image center and create corrected rotation matrix
-        img_h, img_w, *_ = cv2_img.shape #returns (number of rows of pixels, number of columns of pixels, number of channels)
-        img_center = (img_w/2, img_h/2)
-        rotation_matrix = cv2.getRotationMatrix2D(img_center, angle, 1.0)
-
-        #take sin and cos of rotation_matrix, abs to make it them positive
-        cos = np.abs(rotation_matrix[0][0])
-        sin = np.abs(rotation_matrix[0][1])
-
-        #calculate new width and height
-        new_w = int((img_h * cos) + (img_w * sin)) 
-        new_h = int((img_h * sin) + (img_w * cos)) 
- 
-        #update new values to the rotation_matrix
-        rotation_matrix[0][2] += (new_w/2) - img_center[0]
-        rotation_matrix[1][2] += (new_h/2) - img_center[1]
-
-        #rotate the image
-        rotated_img = cv2.warpAffine(threshold_img, rotation_matrix, (new_w, new_h), borderMode=cv2.BORDER_REPLICATE)
-        
-        #convert cv2 image back to PIL
-        final_img = Image.fromarray(cv2.cvtColor(rotated_img, cv2.COLOR_BGR2RGB))
+    #fine pass on the bigger copy around the coarse result
+    fine_points = foreground_points(fine_img)
+    angle = best_angle(fine_points, np.arange(angle - 1.0, angle + 1.05, 0.1))
+    
+    #text lines are straight now, but the text might still be upside down
+    #ascenders tell for mixed case text, all caps text and digits have none, so fall back to the line margins
+    flip_score = upright_score(row_profile(fine_points, angle))
+    upright_known = abs(flip_score) >= flip_threshold
+    if not upright_known:
+        flip_score = margin_score(fine_points, angle)
+        upright_known = abs(flip_score) >= margin_threshold
+    #
+    if flip_score < 0:
+        angle += 180
     #
-    #final_img.save("test_prepro.jpg") #DEBUG
+    #keep the angle between -180 and 180
+    angle = (angle + 180) % 360 - 180
     
-    return final_img
+    return angle, upright_known
 #
-#main function for the whole text detection pass
-#todo: add more regex options for different formats, such as dates with "-" or "/"
-#todo: if there are multiple vat values, find the vat € amount as well
-def detect_text_from_img(img):
-    #preprocess the image
-    processed_img = preprocess(img)
+#shrink an image by a whole number factor so the longer side is at most max_size
+#returns the small image and the factor used
+def shrink(img, max_size):
+    img_h, img_w = img.shape[:2]
+    factor = -(-max(img_h, img_w) // max_size) #round up
+    if factor <= 1:
+        return img, 1
+    #
+    #opencv has a much faster INTER_AREA path for whole number factors, so cut off the leftover edge pixels (a view, not a copy)
+    img_h, img_w = img_h - img_h % factor, img_w - img_w % factor
+    small_img = cv2.resize(img[:img_h, :img_w], (img_w // factor, img_h // factor), interpolation=cv2.INTER_AREA)
+    return small_img, factor
+#
+#downscale a thresholded image so the longer side is at most max_size
+def downscale(threshold_img, max_size):
+    small_img, factor = shrink(threshold_img, max_size)
+    if factor > 1:
+        #INTER_AREA averages pixels, so thin text doesn't disappear, threshold again to keep only solid text
+        cv2.threshold(small_img, 127, 255, cv2.THRESH_BINARY, dst=small_img)
+    #
+    return small_img
+#
+#return the foreground pixels of a small image as float32 x, y arrays
+def foreground_points(small_img):
+    points = cv2.findNonZero(small_img)
+    if points is None:
+        return None
+    #
+    points = points.reshape(-1, 2).astype(np.float32)
+    return points[:, 0], points[:, 1]
+#
+#row sums of the image after rotating it by angle, computed straight from the points instead of warping the image
+#matches cv2.getRotationMatrix2D: rotated y = -sin(angle) * x + cos(angle) * y
+def row_profile(points, angle):
+    xs, ys = points
+    rad = np.deg2rad(angle)
+    rows = ys * np.cos(rad) - xs * np.sin(rad)
+    rows -= rows.min()
+    return np.bincount(rows.astype(np.int32))
+#
+#return the angle with the sharpest row profile (highest sum of squared row sums)
+#multiplied by the profile length, otherwise whichever direction the text block is narrower in wins
+def best_angle(points, angles):
+    scores = []
+    for angle in angles:
+        profile = row_profile(points, angle)
+        scores.append(len(profile) * float(np.dot(profile, profile)))
+    #
+    return float(angles[int(np.argmax(scores))])
+#
+#latin text has more ascenders than descenders, so the ink of an upright line sits below the middle of the line
+#returns > 0 for upright text, < 0 for upside down text, close to 0 if it can't tell
+def upright_score(profile):
+    #text lines are runs of rows with a meaningful amount of ink
+    ink = profile > profile.max() * 0.05
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], ink.astype(np.int8), [0]))))
+    starts, ends = edges[0::2], edges[1::2]
+    if len(starts) == 0:
+        return 0.0
+    #
+    #ink mass and center of mass per line
+    line_profile = np.where(ink, profile, 0).astype(np.float64)
+    mass = np.add.reduceat(line_profile, starts)
+    moment = np.add.reduceat(line_profile * np.arange(len(profile)), starts)
+    center = moment / mass
     
-    #try to get img_info and parse out detected rotation, may fail due to insufficient dpi
-    rotate = 0
-    try:
-        img_info = pytesseract.image_to_osd(processed_img)
-        rotate = float(re.search(r"(?<=Rotate: )\d+", img_info).group(0))
-    except Exception:
-        pass
+    #offset of the center of mass from the middle of each line, relative to line height, weighted by ink
+    offset = (center - (starts + ends - 1) / 2) / (ends - starts)
+    return float(np.dot(offset, mass) / mass.sum())
+#
+#receipts are left aligned: names, dates and footers start at the left margin, only the prices line up on the right
+#upside down the ragged edge is on the left, this works for all caps text and digits too
+#returns the share of left aligned lines minus the share of right aligned lines, > 0 for upright text, < 0 for upside down text
+def margin_score(points, angle):
+    xs, ys = points
+    rad = np.deg2rad(angle)
+    rows = ys * np.cos(rad) - xs * np.sin(rad)
+    cols = xs * np.cos(rad) + ys * np.sin(rad)
+    rows = (rows - rows.min()).astype(np.int32)
+    
+    #text lines are runs of rows with a meaningful amount of ink, same as in upright_score
+    profile = np.bincount(rows)
+    ink = profile > profile.max() * 0.05
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], ink.astype(np.int8), [0]))))
+    starts, ends = edges[0::2], edges[1::2]
+    if len(starts) < 3: #too few lines to say anything about margins
+        return 0.0
     #
-    #rotate image if needed
-    if rotate != 0:
-        processed_img = processed_img.rotate(-rotate, expand=True, fillcolor="black")
+    #first and last ink column of every line, points between lines are dropped
+    line = np.searchsorted(starts, rows, side="right") - 1
+    in_line = (line >= 0) & (rows < ends[np.maximum(line, 0)])
+    line, cols = line[in_line], cols[in_line]
+    first = np.full(len(starts), np.inf)
+    last = np.full(len(starts), -np.inf)
+    np.minimum.at(first, line, cols)
+    np.maximum.at(last, line, cols)
+    
+    #lines line up with each other if they start (or end) within half a line height
+    #the most common start and end are the margins, a single speck of noise doesn't move them
+    tolerance = np.median(ends - starts) / 2
+    left = (np.abs(first[:, None] - first[None, :]) <= tolerance).sum(axis=0).max()
+    right = (np.abs(last[:, None] - last[None, :]) <= tolerance).sum(axis=0).max()
+    return float(left - right) / len(starts)
+#
+#rotate an image counter-clockwise by angle with a single warp, expanding the canvas so nothing gets cut off
+def rotate_img(img, angle):
+    #exact quarter turns don't need interpolation
+    quarter_turns = {90: cv2.ROTATE_90_COUNTERCLOCKWISE, 180: cv2.ROTATE_180, -180: cv2.ROTATE_180, -90: cv2.ROTATE_90_CLOCKWISE}
+    if abs(angle) < 0.05:
+        return img
     #
+    if round(angle) in quarter_turns and abs(angle - round(angle)) < 0.05:
+        return cv2.rotate(img, quarter_turns[round(angle)])
+    #
+    #get image center and create corrected rotation matrix
+    img_h, img_w = img.shape
+    img_center = (img_w/2, img_h/2)
+    rotation_matrix = cv2.getRotationMatrix2D(img_center, angle, 1.0)
+
+    #take sin and cos of rotation_matrix, abs to make it them positive
+    cos = np.abs(rotation_matrix[0][0])
+    sin = np.abs(rotation_matrix[0][1])
+
+    #calculate new width and height
+    new_w = int((img_h * sin) + (img_w * cos))
+    new_h = int((img_h * cos) + (img_w * sin))
+
+    #update new values to the rotation_matrix
+    rotation_matrix[0][2] += (new_w/2) - img_center[0]
+    rotation_matrix[1][2] += (new_h/2) - img_center[1]
+
+    #rotate the image, outside area is filled with background (black)
+    return cv2.warpAffine(img, rotation_matrix, (new_w, new_h), borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+#
+#run preprocess and return (processed image, peak bytes allocated while running it)
+#numpy and opencv buffers are tracked by tracemalloc, so this shows the memory cost per worker
+def preprocess_peak_memory(img):
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    #
+    with metrics.traced_peak() as peak:
+        processed_img = preprocess(img)[0]
+    #
+    peak = peak.bytes()
+    if not already_tracing:
+        tracemalloc.stop()
+    #
+    return processed_img, peak
+#
+#main function for the whole text detection pass
+#results are cached on the image contents, so the same image is only run through OCR once
+#if an info dict is given, it gets filled with details about the run (cache hit, ocr tier used and time per tier)
+#returns the parsed fields (see receipt_parser.parse) and the raw OCR text as "text", so it can be saved for searching
+def detect_text_from_img(img, use_cache=True, info=None):
+    if info is None:
+        info = {}
+    #
+    info["cached"] = False
+    metrics.new_run()
+    if not use_cache:
+        text = read_text(img, info)
+        with metrics.stage("parse"):
+            result = parse_text(text)
+        #
+        return dict(result, text=text)
+    #
+    with metrics.stage("cache_lookup"):
+        cache = ocr_cache.get_cache()
+        key = cache.make_key(img, config_key())
+        cached = cache.get(key)
+    #
+    if cached:
+        info["cached"] = True
+        return dict(cached[1], text=cached[0])
+    #
+    text = read_text(img, info)
+    with metrics.stage("parse"):
+        result = parse_text(text)
+    #
+    with metrics.stage("cache_store"):
+        cache.put(key, text, result)
+    #
+    return dict(result, text=text)
+#
+#settings that change the detection result, used as part of the cache key
+#bump the versions whenever preprocessing or parsing changes
+def config_key():
+    engine = ocr_engine.get_engine()
+    key = f"preprocess{preprocess_version}|parse{parse_version}|osd{use_osd}|crop{crop_receipts}|{ocr_mode}|{engine.lang}|{engine.config}"
+    if ocr_mode == "tiered":
+        key += f"|{ocr_tiers}|{min_confidence}"
+    #
+    return key
+#
+#preprocess the image and run it through tesseract, returns the raw detected text
+def read_text(img, info=None):
+    if info is None:
+        info = {}
+    #
+    #preprocess the image, this already straightens it and turns it the right way up in most cases
+    processed_img, upright_known = preprocess(img)
     
+    #long-lived tesseract engine, models stay loaded between calls
+    engine = ocr_engine.get_engine()
+    
+    #tesseract orientation detection is only needed if preprocessing couldn't tell which way is up
+    #try to get detected rotation, may fail due to insufficient dpi
+    if use_osd or not upright_known:
+        with metrics.stage("osd"):
+            rotate = 0
+            try:
+                rotate = engine.detect_rotation(processed_img)
+            except Exception:
+                pass
+            #
+            #rotate image if needed
+            if rotate != 0:
+                processed_img = processed_img.rotate(-rotate, expand=True, fillcolor="black")
+            #
+        #
+    #
+    #cheapest tier that gives a complete, confident result, with no tiers configured the full pass below is used
+    if ocr_mode == "tiered" and ocr_tiers:
+        with metrics.stage("ocr", mode=ocr_mode):
+            return read_text_tiered(processed_img, info)
+        #
+    #
+    #only recognize the interesting lines, good enough if every field can be parsed from them
+    if ocr_mode == "regions":
+        with metrics.stage("ocr", mode=ocr_mode):
+            text = read_text_regions(processed_img)
+        #
+        if None not in parse_text(text).values():
+            return text
+        #
+    #
     #detect text with tesseract ocr
-    text = pytesseract.image_to_string(processed_img, lang="eng+fin", config="--psm 6 --oem 3")
+    with metrics.stage("ocr", mode="full"):
+        text = engine.image_to_string(processed_img)
+    #
     
     #print(f"\n##Raw text##\n{text}") #DEBUG
     
-    #initialize result data format
-    result = {"date_time": None, "price": None, "vat": None}
-    
-    #search for date format strings (x.x.xxxx, xx.xx.xxxx, xx.x.xxxx, x.xx.xxxx)
-    date_match = re.search(r"\b\d{1,2}\.\d{1,2}\.\d{4}\b", text)
-    if date_match:
-        result["date_time"] = date_match.group()
-        #search for time format strings (x:xx, xx:xx, xx:xx:xx)
-        time_match = re.search(r"\b\d{1,2}\:\d{2}(\:\d{2}|)\b", text)
-        if time_match:
-            result["date_time"] += " " + time_match.group()
-        else:
-            result["date_time"] += " 00:00" #add blank time
-        #
-    #
-    #search for price keywords
-    price_keywords = ["summa", "amount", "yhteensä", "yht"]
-    for keyword in price_keywords:
-        index = text.lower().find(keyword)
-        if index != -1:
-            line_start = text.rfind('\n', 0, index) + 1
-            line_end = text.find('\n', index)
+    return text
+#
+#ocr strategies for "tiered" mode, from the cheapest to the most expensive
+#lang = tesseract languages, psm = page segmentation mode, scale = image size multiplier
+ocr_tiers = [
+    {"name": "fin_half", "lang": "fin", "psm": 6, "scale": 0.5},
+    {"name": "fin", "lang": "fin", "psm": 6, "scale": 1.0},
+    {"name": "eng+fin", "lang": "eng+fin", "psm": 6, "scale": 1.0},
+]
+#mean word confidence (0-100) needed to accept a tier's result
+min_confidence = 70
 
-            #remove leading and trailing whitespaces
-            price_text = text[line_start:line_end].strip()
-            
-            #only get digits and decimals
-            price_text_cleaned = ""
-            for character in price_text:
-                if character.isdigit() or character == "." or character == ",":
-                    price_text_cleaned += character
-                #
+#how many times each tier has run / been accepted and the total time spent in it, since the program started
+tier_stats = {}
+tier_stats_lock = threading.Lock()
+
+#run the ocr tiers in order, escalate when a field is missing or the words were recognized with low confidence
+#the last tier is always accepted
+def read_text_tiered(processed_img, info):
+    if not ocr_tiers:
+        raise ValueError("ocr_tiers is empty, tiered mode needs at least one tier")
+    #
+    info["tier_times"] = {}
+    for index, tier in enumerate(ocr_tiers):
+        start = time.perf_counter()
+        with metrics.stage("ocr_tier", tier=tier["name"]) as tier_stage:
+            tier_img = processed_img
+            if tier["scale"] != 1:
+                new_size = (max(1, int(processed_img.width * tier["scale"])), max(1, int(processed_img.height * tier["scale"])))
+                tier_img = processed_img.resize(new_size, Image.Resampling.BILINEAR)
             #
-            #convert price to float
-            price_float = str_to_float(price_text_cleaned)
-            formatted_price = "{:.2f}".format(price_float)
+            engine = ocr_engine.get_engine(lang=tier["lang"], psm=tier["psm"])
+            lines = engine.image_to_lines(tier_img)
+            text = "\n".join(line["text"] for line in lines)
             
-            #apply new price value if none or higher than previous
-            if not result["price"]:
-                result["price"] = formatted_price
-            else: 
-                if formatted_price > result["price"]:
-                    result["price"] = formatted_price
-                #
+            confs = [conf for line in lines for conf in line["confs"] if conf >= 0]
+            confidence = sum(confs) / len(confs) if confs else 0.0
+            accepted = (index == len(ocr_tiers) - 1 or
+                (confidence >= min_confidence and None not in parse_text(text).values()))
+            tier_stage.fields["accepted"] = accepted
+        #
+        elapsed = time.perf_counter() - start
+        info["tier_times"][tier["name"]] = elapsed
+        with tier_stats_lock:
+            stats = tier_stats.setdefault(tier["name"], {"runs": 0, "accepted": 0, "seconds": 0.0})
+            stats["runs"] += 1
+            stats["accepted"] += accepted
+            stats["seconds"] += elapsed
+        #
+        if accepted:
+            info["tier"] = tier["name"]
+            info["confidence"] = confidence
+            return text
+        #
+    #
+#
+#how much smaller the image for the quick line finding pass is
+region_scan_factor = 2
+#how many line crops are recognized at the same time
+region_workers = min(4, os.cpu_count() or 1)
+#lines the parser needs: totals, vat, dates and times
+region_pattern = re.compile(r"summa|yhteens|yht|amount|total|alv|vat|%|\d{1,2}[./-]\d{1,2}[./-]\d{2,4}|\d{1,2}:\d{2}", re.IGNORECASE)
+#vat is often a small table under an "alv" header, so take a few lines after it as well
+vat_pattern = re.compile(r"alv|vat", re.IGNORECASE)
+vat_table_lines = 3
+
+#thread pool for line crops, tesseract releases the GIL (or runs as a subprocess) so threads run in parallel
+#created on first use, the lock keeps two detection threads from both creating one
+region_pool = None
+region_pool_lock = threading.Lock()
+
+def get_region_pool():
+    global region_pool
+    if region_pool is None:
+        with region_pool_lock:
+            if region_pool is None:
+                region_pool = ThreadPoolExecutor(region_workers, thread_name_prefix="region")
             #
         #
     #
-    #find every occurence of vat keywords in text
-    vat_keywords = ["alv", "vat", "%"]
-    for keyword in vat_keywords:
-        position = 0
-        words_found = True
-        while words_found:
-            index = text.lower().find(keyword, position) #find keywords starting from index(position)
-            if index != -1:
-                line_start = text.rfind('\n', 0, index) + 1
-                line_end = text.find('\n', index)
-                position = line_end
-
-                #remove leading and trailing whitespaces
-                vat_text = text[line_start:line_end].strip()
-                if "%" in vat_text:
-                    vat_text = text[line_start:index+1].strip() #strip everything after %
-                #
-                #search for vat format (xx,xx%, xx.xx%, xx%)
-                vat_text_match = re.search(r"\d{1,2}(\,|\.|)\d{0,2}(\%|\ \%)", vat_text)
-                if vat_text_match:
-                    vat_text_with_extras = vat_text_match.group()
-                    
-                    #only get digits and decimals
-                    vat_text_cleaned = ""
-                    for character in vat_text_with_extras:
-                        if character.isdigit() or character == "." or character == ",":
-                            vat_text_cleaned += character
-                        #
-                    #
-                    #convert price to float
-                    vat_float = str_to_float(vat_text_cleaned)
-                    formatted_vat = "{:.2f}".format(vat_float)
-                    
-                    #apply new vat value if none or higher than previous
-                    if not result["vat"]:
-                        result["vat"] = formatted_vat
-                    else: 
-                        if formatted_price > result["vat"]:
-                            result["vat"] = formatted_vat
-                        #
-                    #
-                #
-            else:
-                words_found = False
+    return region_pool
+#
+
+#two pass OCR: find the lines on a smaller copy, then recognize just the wanted lines at full resolution
+def read_text_regions(processed_img):
+    #quick pass to find where the lines are and roughly what they say
+    small_img = processed_img.reduce(region_scan_factor)
+    lines = ocr_engine.get_engine().image_to_lines(small_img)
+    
+    wanted = set()
+    for index, line in enumerate(lines):
+        if region_pattern.search(line["text"]):
+            wanted.add(index)
+            if vat_pattern.search(line["text"]):
+                wanted.update(range(index + 1, min(index + 1 + vat_table_lines, len(lines))))
             #
         #
     #
-    return result
+    if not wanted:
+        return ""
+    #
+    #full width strips around the wanted lines, so nothing at the edges (like prices on the right) gets cut off
+    img_w, img_h = processed_img.size
+    crops = []
+    for index in sorted(wanted, key=lambda i: lines[i]["box"][1]):
+        top = lines[index]["box"][1] * region_scan_factor
+        bottom = lines[index]["box"][3] * region_scan_factor
+        padding = (bottom - top) // 4
+        crops.append(processed_img.crop((0, max(0, top - padding), img_w, min(img_h, bottom + padding))))
+    #
+    #recognize every strip as a single line of text, in parallel
+    line_engine = ocr_engine.get_engine(psm=7)
+    texts = get_region_pool().map(line_engine.image_to_string, crops)
+    
+    return "\n".join(text.strip() for text in texts)
+#
+#parse date & time, total price and VAT (every rate with its amount) from the detected text
+def parse_text(text):
+    return receipt_parser.parse(text)
 #
-#convert "," to "." so python recognizes floats
-def str_to_float(str):
-    if "," in str:
-        str = str.replace(",", ".")
+#debug helper: run text detection on an image file and report preprocessing time and peak memory
+#usage: python text_recognition.py <image file> [--stages] [--profile out.prof]
+#--stages prints the time of every pipeline stage, --profile runs the detection once under cProfile
+if __name__ == "__main__":
+    import argparse, resource
+    
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image")
+    parser.add_argument("--stages", action="store_true")
+    parser.add_argument("--profile", metavar="PATH")
+    args = parser.parse_args()
+    
+    if args.stages:
+        metrics.add_sink(lambda record: print(f"{record['stage']:>12}: {record['seconds']*1000:8.1f} ms"))
+    #
+    with Image.open(args.image) as img:
+        img.load()
+        start = time.perf_counter()
+        processed_img, peak = preprocess_peak_memory(img)
+        elapsed = time.perf_counter() - start
+        
+        print(f"preprocess: {elapsed*1000:.0f} ms, peak {peak / 2**20:.1f} MiB, output {processed_img.mode} {processed_img.size}")
+        if args.profile:
+            print(metrics.profile_run(detect_text_from_img, img, False, path=args.profile))
+        else:
+            print(detect_text_from_img(img, use_cache=False))
+        #
+        #ru_maxrss is in KiB on linux
+        print(f"process peak rss: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
     #
-    return float(str)
 #
@@ -0,0 +1,393 @@
+import argparse
+import collections
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import os
+import queue
+import select
+import signal
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+#own scripts
+import db_helper as db
+import batch_app
+
+#hot folder mode: watch a folder (e.g. the output folder of a document scanner) and save every new receipt image into the database
+#new files are noticed with inotify on linux, elsewhere the folder is checked every few seconds, only the folder itself is watched
+#files are recognized by a hash of their contents, so a scan that is dropped again (or copied under another name) is never read twice
+#usage: python watch_app.py <folder> [--workers N] [--queue N] [--poll] [--stats file]
+
+poll_interval = 2.0 #seconds between folder checks without inotify
+stats_interval = 60.0 #seconds between stats lines on stderr and in the stats file
+stats_path = "watch_stats.json" #latest stats, rewritten every stats_interval
+latency_samples = 1000 #latest files kept for the latency percentiles
+hash_block = 1024 * 1024 #bytes read at once when hashing a file
+
+#inotify constants from <sys/inotify.h>
+in_close_write = 0x8 #a file opened for writing was closed, so it's complete
+in_moved_to = 0x80 #a file was moved into the folder, e.g. renamed from a temporary name
+in_q_overflow = 0x4000 #the kernel's event queue was full and events were lost
+in_isdir = 0x40000000
+event_header = struct.Struct("iIII") #wd, mask, cookie, name length
+
+def is_image(name):
+    return name.lower().endswith(batch_app.image_extensions)
+#
+#every image file in the folder, oldest first so files are handled in the order they arrived
+def list_images(folder):
+    entries = []
+    for entry in os.scandir(folder):
+        if entry.is_file() and is_image(entry.name):
+            try:
+                entries.append((entry.stat().st_mtime_ns, entry.path))
+            except OSError:
+                pass #removed while listing
+            #
+        #
+    #
+    return [path for _, path in sorted(entries)]
+#
+#new and changed files from inotify (linux), read() waits for events at most timeout seconds
+#files already in the folder are returned by the first read()
+class Inotify_watcher():
+    def __init__(self, folder):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.folder = folder
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        #
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), in_close_write | in_moved_to) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, "inotify_add_watch failed", folder)
+        #
+        self.found = list_images(folder)
+    #
+    def read(self, timeout):
+        if self.found:
+            files, self.found = self.found, []
+            return files
+        #
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        #
+        data = os.read(self.fd, 64 * 1024)
+        files = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = event_header.unpack_from(data, offset)
+            name = data[offset + event_header.size:offset + event_header.size + length].rstrip(b"\0")
+            offset += event_header.size + length
+            if mask & in_q_overflow:
+                return list_images(self.folder) #events were lost, go through every file, the hashes skip the handled ones
+            #
+            if name and not mask & in_isdir and is_image(os.fsdecode(name)):
+                files.append(os.path.join(self.folder, os.fsdecode(name)))
+            #
+        #
+        return files
+    #
+    def close(self):
+        os.close(self.fd)
+    #
+#
+#new and changed files found by checking the folder every interval seconds, for systems without inotify
+#a file is returned once its size and modification time stay the same between two checks, so it's no longer being written
+class Poll_watcher():
+    def __init__(self, folder, interval=None):
+        self.folder = folder
+        self.interval = interval or poll_interval
+        self.seen = {} #path: (size, mtime) at the last check
+        self.returned = {} #path: (size, mtime) when it was returned
+        self.next_check = time.monotonic()
+    #
+    def read(self, timeout):
+        wait = self.next_check - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        #
+        time.sleep(max(0, wait))
+        self.next_check = time.monotonic() + self.interval
+
+        files = []
+        seen = {}
+        for path in list_images(self.folder):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            #
+            seen[path] = (stat.st_size, stat.st_mtime_ns)
+            if self.seen.get(path) == seen[path] and self.returned.get(path) != seen[path]:
+                self.returned[path] = seen[path]
+                files.append(path)
+            #
+        #
+        self.seen = seen
+        self.returned = {path: state for path, state in self.returned.items() if path in seen}
+        return files
+    #
+    def close(self):
+        pass
+    #
+#
+#inotify if the system has it, otherwise polling
+def make_watcher(folder, poll=False):
+    if not poll:
+        try:
+            return Inotify_watcher(folder)
+        except (OSError, AttributeError) as e: #AttributeError: libc without inotify
+            print(f"inotify not available ({e}), checking the folder every {poll_interval:g}s", file=sys.stderr)
+        #
+    #
+    return Poll_watcher(folder)
+#
+#hash of the file contents, blake2b like the OCR cache
+def file_hash(path):
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(hash_block), b""):
+            h.update(block)
+        #
+    #
+    return h.hexdigest()
+#
+#ctrl+c and SIGTERM (e.g. systemd stopping the whole process group) stop the daemon from the main process,
+#the workers ignore them and finish the files they have
+def init_worker(ocr_mode, metrics_path=None):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    batch_app.init_worker(ocr_mode, metrics_path)
+#
+#{"p50", "p95", "max"} seconds of the latest samples
+def percentiles(samples):
+    if not samples:
+        return None
+    #
+    ordered = sorted(samples)
+    pick = lambda share: round(ordered[min(len(ordered) - 1, int(share * len(ordered)))], 3)
+    return {"p50": pick(0.5), "p95": pick(0.95), "max": round(ordered[-1], 3)}
+#
+#watches the folder and streams new files through a pool of OCR worker processes into the database
+#at most max_queue files are handed to the pool at a time, when it's full no more events are read,
+#so a big pile of scans waits in the folder (and in the kernel's event queue) instead of in memory
+#if a worker dies (tesseract crash, out of memory), every file in the pool fails and a new pool is started,
+#the files are then tried again one at a time, so only the file that kills its worker is given up as an error
+class Hot_folder():
+    def __init__(self, folder, workers=None, max_queue=None, poll=False, ocr_mode="full", metrics_path=None, stats=stats_path):
+        self.folder = os.path.abspath(folder)
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue or 2 * self.workers #enough to keep every worker busy while results are saved
+        self.stats_path = stats
+        self.watcher = make_watcher(self.folder, poll)
+        self.worker_args = (ocr_mode, metrics_path)
+        self.pool = None
+        self.pools_started = 0
+        self.start_pool()
+
+        self.waiting = collections.deque() #(path, time found) not handed to the pool yet
+        self.retry = collections.deque() #(hash, path, time found) lost with a worker that died, tried again one at a time
+        self.in_flight = {} #hash: (path, time found, pool number, alone) handed to the pool
+        self.results = queue.Queue() #(hash, future) of finished files, from the pool's thread
+        self.running = False
+
+        #stats
+        self.started = time.time()
+        self.counts = {"found": 0, "saved": 0, "invalid": 0, "error": 0, "duplicate": 0, "retried": 0}
+        self.latencies = collections.deque(maxlen=latency_samples) #seconds from noticing a file to saving it
+        self.ocr_times = collections.deque(maxlen=latency_samples) #seconds spent in the worker
+    #
+    #run until stop() (or ctrl+c / SIGTERM through main), then finish the files already handed to the pool
+    def run(self):
+        self.running = True
+        next_stats = time.monotonic() + stats_interval
+        while self.running:
+            full = len(self.in_flight) >= self.max_queue
+            self.save_results(wait=full)
+            if not full:
+                if not self.waiting:
+                    #short waits while files are being read, so results are saved as soon as they arrive
+                    found = self.watcher.read(0.1 if self.in_flight or self.retry else 1.0)
+                    self.waiting.extend((path, time.monotonic()) for path in found)
+                    self.counts["found"] += len(found)
+                #
+                self.submit()
+            #
+            if time.monotonic() >= next_stats:
+                next_stats = time.monotonic() + stats_interval
+                self.report()
+            #
+        #
+        while self.in_flight:
+            self.save_results(wait=True)
+        #
+        self.pool.shutdown()
+        self.watcher.close()
+        self.report()
+    #
+    def stop(self):
+        self.running = False
+    #
+    #worker processes are started when the first files are handed to the pool
+    def start_pool(self):
+        if self.pool:
+            self.pool.shutdown(wait=False)
+        #
+        self.pool = ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=self.worker_args)
+        self.pools_started += 1
+    #
+    #hand waiting files to the pool until it's full, skipping files whose contents have been seen before
+    #files lost with a dead worker go first, each on its own in the pool
+    def submit(self):
+        if self.retry:
+            if not self.in_flight:
+                self.start_file(*self.retry.popleft(), alone=True)
+            #
+            return
+        #
+        while self.waiting and len(self.in_flight) < self.max_queue:
+            path, found = self.waiting.popleft()
+            try:
+                digest = file_hash(path)
+            except OSError:
+                continue #removed before it could be read
+            #
+            if digest in self.in_flight or any(digest == retry[0] for retry in self.retry) or db.ingested(digest):
+                self.counts["duplicate"] += 1
+                print(f"{os.path.basename(path)}: already read", file=sys.stderr)
+                continue
+            #
+            self.start_file(digest, path, found, alone=False)
+        #
+    #
+    def start_file(self, digest, path, found, alone):
+        self.in_flight[digest] = (path, found, self.pools_started, alone)
+        future = self.pool.submit(batch_app.process_file, path)
+        future.add_done_callback(lambda future, digest=digest: self.results.put((digest, future)))
+    #
+    #save every result that has arrived, all in one transaction, wait=True waits up to a second for the first one
+    #files that failed aren't recorded, so they're read again if they're dropped again
+    def save_results(self, wait=False):
+        try:
+            items = [self.results.get(timeout=1.0) if wait else self.results.get_nowait()]
+        except queue.Empty:
+            return
+        #
+        while True:
+            try:
+                items.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+            #
+        #
+        files, found_times = [], []
+        for digest, future in items:
+            path, found, pool_number, alone = self.in_flight.pop(digest)
+            try:
+                _, result, info, error, elapsed = future.result()
+            except BrokenProcessPool:
+                #a worker died, every file in that pool fails, the pool is replaced once
+                if pool_number == self.pools_started:
+                    self.start_pool()
+                #
+                if alone:
+                    self.counts["error"] += 1
+                    print(f"{os.path.basename(path)}: the worker reading it died, skipped", file=sys.stderr)
+                else:
+                    self.counts["retried"] += 1
+                    self.retry.append((digest, path, found))
+                #
+                continue
+            except Exception as e: #e.g. the result couldn't be sent back from the worker
+                result, error, elapsed = None, f"{type(e).__name__}: {e}", 0.0
+            #
+            self.ocr_times.append(elapsed)
+            if error:
+                self.counts["error"] += 1
+                print(f"{os.path.basename(path)}: {error}", file=sys.stderr)
+            else:
+                files.append((digest, path, result))
+                found_times.append((found, elapsed))
+            #
+        #
+        if not files:
+            return
+        #
+        rejected = dict(db.add_files(files))
+        now = time.monotonic()
+        for index, (_, path, _) in enumerate(files):
+            found, elapsed = found_times[index]
+            self.latencies.append(now - found)
+            if index in rejected:
+                self.counts["invalid"] += 1
+                print(f"{os.path.basename(path)}: not saved, {rejected[index]} ({elapsed:.2f}s)", file=sys.stderr)
+            else:
+                self.counts["saved"] += 1
+                print(f"{os.path.basename(path)}: saved ({elapsed:.2f}s)", file=sys.stderr)
+            #
+        #
+    #
+    #current counts, queue depth and latencies
+    #queued is found but not read yet, running is being read by a worker
+    def stats(self):
+        running = min(len(self.in_flight), self.workers)
+        return dict(self.counts,
+            queued=len(self.waiting) + len(self.retry) + len(self.in_flight) - running,
+            running=running,
+            workers=self.workers,
+            latency=percentiles(self.latencies),
+            ocr=percentiles(self.ocr_times),
+            uptime=round(time.time() - self.started),
+            time=time.time(),
+        )
+    #
+    #print the stats and write them into the stats file, e.g. for a monitoring script
+    def report(self):
+        stats = self.stats()
+        latency = stats["latency"] or {"p50": 0, "p95": 0}
+        print(f"saved {stats['saved']}, invalid {stats['invalid']}, errors {stats['error']}, duplicates {stats['duplicate']}, "
+            f"queued {stats['queued']}, running {stats['running']}, latency p50 {latency['p50']:.2f}s p95 {latency['p95']:.2f}s", file=sys.stderr)
+        if self.stats_path:
+            with open(self.stats_path + ".part", "w", encoding="utf-8") as f:
+                json.dump(stats, f)
+            #
+            os.replace(self.stats_path + ".part", self.stats_path)
+        #
+    #
+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="watch a folder and save every new receipt image into the database")
+    parser.add_argument("folder", help="folder to watch, e.g. the output folder of a scanner")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="worker processes (default: number of cores)")
+    parser.add_argument("--queue", type=int, default=None, help="max files handed to the workers at once (default: 2 per worker)")
+    parser.add_argument("--poll", action="store_true", help="check the folder every few seconds instead of using inotify")
+    parser.add_argument("--stats", default=stats_path, help="file the latest stats are written into")
+    parser.add_argument("--metrics", metavar="FILE", help="append per-stage timings of every image to this json-lines file")
+    parser.add_argument("--mode", choices=("full", "regions", "tiered"), default="full", help="OCR the whole receipt, only the lines with the needed fields, or cheapest good enough tier")
+    parser.add_argument("--db", default=db.db_name, help="database file")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.folder):
+        print(f"{args.folder} is not a folder", file=sys.stderr)
+        return 2
+    #
+    db.db_name = args.db
+    hot_folder = Hot_folder(args.folder, args.workers, args.queue, args.poll, args.mode, args.metrics, args.stats)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: hot_folder.stop())
+    #
+    print(f"watching {hot_folder.folder} with {hot_folder.workers} workers, ctrl+c to stop", file=sys.stderr)
+    hot_folder.run()
+    return 0
+#
+if __name__ == "__main__":
+    sys.exit(main())
+#